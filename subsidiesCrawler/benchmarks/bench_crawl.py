@@ -0,0 +1,160 @@
+"""Offline throughput benchmark of francsenergie_spider.
+
+Replays a recorded archive (see subsidiesCrawler.replay) through the
+whole crawl - spider, pipeline, middlewares - without network access and
+reports pages/s, items/s, parse time per page, peak RSS and output size.
+
+Record the archive once, from the project directory:
+
+    scrapy crawl francsenergie_spider -s HTTPCACHE_ENABLED=1
+
+then run the benchmark, optionally comparing with a previous result:
+
+    python benchmarks/bench_crawl.py --output bench.json
+    python benchmarks/bench_crawl.py --baseline bench.json --tolerance 0.2
+
+With --baseline, the exit status is 1 when a metric regresses by more
+than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'subsidiesCrawler.settings')
+
+from scrapy.crawler import CrawlerProcess  # noqa: E402
+from scrapy.utils.project import get_project_settings  # noqa: E402
+
+from subsidiesCrawler.spiders.francsenergie_spider import MySpider  # noqa: E402
+
+
+# Métrique -> True si une valeur plus grande est meilleure
+METRICS = {
+    'pages_per_second': True,
+    'items_per_second': True,
+    'parse_ms_per_page': False,
+    'peak_rss_mb': False,
+    'output_bytes': False,
+}
+
+
+class TimedSpider(MySpider):
+    # Mesure le temps de parse seul : les items sont collectés avant d'être rendus à Scrapy
+    parse_seconds = 0.0
+    parsed_pages = 0
+
+    async def parse(self, response):
+        start = time.perf_counter()
+        results = [result async for result in super().parse(response)]
+        TimedSpider.parse_seconds += time.perf_counter() - start
+        TimedSpider.parsed_pages += 1
+        for result in results:
+            yield result
+
+
+def peak_rss_mb():
+    # ru_maxrss est en octets sous macOS, en Ko sous Linux
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def run(args):
+    output_dir = tempfile.mkdtemp(prefix='bench-subsidies-')
+    settings = get_project_settings()
+    settings.setdict({
+        'HTTPCACHE_ENABLED': True,
+        'HTTPCACHE_IGNORE_MISSING': True,
+        'INCREMENTAL_CRAWL': False,
+        'SUBSIDIES_OUTPUT_DIR': output_dir,
+        'SUBSIDIES_OUTPUT_FORMAT': args.format,
+        # Ni index, ni flux de changements, ni rapports : le benchmark ne touche pas aux fichiers du projet
+        'SUBSIDIES_INDEX_PATH': None,
+        'SUBSIDIES_CHANGES_DIR': None,
+        'INSTRUMENTATION_JSON_PATH': None,
+        'INSTRUMENTATION_PROMETHEUS_PATH': None,
+        'INSTRUMENTATION_PROFILE': False,
+        'DIAGNOSTICS_LOG_FILE': None,
+        'LOG_LEVEL': args.log_level,
+    }, priority='cmdline')
+    if args.archive_dir:
+        settings.set('HTTPCACHE_DIR', args.archive_dir, priority='cmdline')
+    spider_args = {'communes': args.communes} if args.communes else {}
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(TimedSpider)
+    process.crawl(crawler, **spider_args)
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    stats = crawler.stats.get_stats()
+    pages = stats.get('response_received_count', 0)
+    items = stats.get('item_scraped_count', 0)
+    results = {
+        'pages': pages,
+        'items': items,
+        'elapsed_seconds': round(elapsed, 3),
+        'pages_per_second': round(pages / elapsed, 2),
+        'items_per_second': round(items / elapsed, 2),
+        'parse_ms_per_page': round(1000 * TimedSpider.parse_seconds / max(1, TimedSpider.parsed_pages), 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'output_bytes': directory_size(output_dir),
+    }
+    shutil.rmtree(output_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        old, new = baseline.get(metric), results.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--communes', help="fichiers de communes (défaut : COMMUNES_SOURCES)")
+    parser.add_argument('--archive-dir', help="HTTPCACHE_DIR contenant l'archive enregistrée")
+    parser.add_argument('--format', default='parquet', choices=['parquet', 'jsonl'])
+    parser.add_argument('--output', help="écrire les résultats dans ce fichier JSON")
+    parser.add_argument('--baseline', help="résultats JSON de référence")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=4))
+    if results['pages'] == 0:
+        sys.exit("Aucune page rejouée : enregistrer d'abord l'archive (voir --help)")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit("Régressions :\n" + "\n".join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Micro-benchmark of the subsidies props extraction on saved pages.
+
+Compares the former parsel path (paragraph dump + CSS selection of the
+div attribute + json.loads) with extract_subsidies_props + loads.
+
+benchmarks/samples holds pages reproducing the francsenergie.ch markup,
+including the marker variants (single quotes, spaces around '=') and a
+page without subsidies component that take the parsel fallback. Real
+pages can be added next to them, e.g.:
+
+    scrapy fetch --nolog https://www.francsenergie.ch/fr/1003-Lausanne/building/personal > benchmarks/samples/lausanne-live.html
+
+Run from the project directory:
+
+    python benchmarks/bench_extractor.py [pages or directories ...]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from parsel import Selector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subsidiesCrawler.extractors import SUBSIDIES_CSS, extract_subsidies_props, loads, orjson  # noqa: E402
+
+
+DEFAULT_SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+
+
+def parsel_path(body):
+    selector = Selector(text=body.decode('utf-8'))
+    selector.css('p::text').getall()
+    div = selector.css(SUBSIDIES_CSS).get()
+    return json.loads(div) if div else None
+
+
+def fast_path(body):
+    div = extract_subsidies_props(body)
+    return loads(div) if div else None
+
+
+def collect(paths):
+    pages = []
+    for path in paths:
+        if os.path.isdir(path):
+            pages.extend(sorted(glob.glob(os.path.join(path, '*.html'))))
+        elif os.path.isfile(path):
+            pages.append(path)
+    return pages
+
+
+def bench(fn, bodies, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            fn(body)
+        best = min(best, time.perf_counter() - start)
+    return best / len(bodies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='*', default=[DEFAULT_SAMPLES])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = collect(args.paths)
+    if not pages:
+        parser.error(f"aucune page .html trouvée dans {', '.join(args.paths)}")
+    bodies = []
+    for page in pages:
+        with open(page, 'rb') as f:
+            bodies.append(f.read())
+
+    # Les deux chemins doivent produire le même résultat
+    for page, body in zip(pages, bodies):
+        if parsel_path(body) != fast_path(body):
+            sys.exit(f"Résultats différents pour {page}")
+
+    slow = bench(parsel_path, bodies, args.repeat)
+    fast = bench(fast_path, bodies, args.repeat)
+    size = sum(len(body) for body in bodies) / len(bodies)
+    print(f"{len(bodies)} pages, {size / 1024:.1f} KiB en moyenne, backend JSON : {'orjson' if orjson else 'json'}")
+    print(f"parsel      : {slow * 1e6:10.1f} µs/page")
+    print(f"fast path   : {fast * 1e6:10.1f} µs/page")
+    print(f"accélération: {slow / fast:10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
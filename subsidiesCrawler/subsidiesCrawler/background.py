@@ -0,0 +1,81 @@
+import logging
+import queue
+import threading
+
+from twisted.internet import defer, threads
+from twisted.python.failure import Failure
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """Run blocking persistence jobs on a single thread, off the reactor.
+
+    Jobs run in submission order. ``submit`` returns a Deferred fired on
+    the reactor thread with the job result. At most ``max_pending`` jobs
+    are handed to the thread at once; further submissions wait, without
+    blocking the reactor, in the semaphore's waiting list, which is not
+    bounded. Producers therefore wait on ``ready()`` (or on the Deferred
+    of their last job) while ``saturated`` is true: the pipeline and the
+    spider do, so the list holds at most a few jobs per item or response
+    in flight.
+    """
+
+    def __init__(self, name='background-writer', max_pending=8):
+        # Import tardif : ne pas installer le reactor par défaut avant celui de Scrapy
+        from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.name = name
+        self.queue = queue.Queue()
+        self.slots = defer.DeferredSemaphore(max_pending)
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    @property
+    def saturated(self):
+        return self.slots.tokens == 0
+
+    def ready(self):
+        # Déclenché quand les jobs déjà soumis ne saturent plus le thread : contre-pression
+        return self.slots.acquire().addCallback(lambda slots: slots.release())
+
+    def submit(self, fn, *args, **kwargs):
+        if self.closed:
+            raise RuntimeError(f"{self.name} est déjà fermé")
+        return self.slots.run(self._enqueue, fn, args, kwargs)
+
+    def _enqueue(self, fn, args, kwargs):
+        d = defer.Deferred()
+        self.queue.put((fn, args, kwargs, d))
+        return d
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            fn, args, kwargs, d = job
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                self.reactor.callFromThread(d.errback, Failure())
+            else:
+                self.reactor.callFromThread(d.callback, result)
+
+    def close(self):
+        # Vide la file puis arrête le thread ; renvoie un Deferred
+        if self.closed:
+            return defer.succeed(None)
+        self.closed = True
+        # Passe par le sémaphore pour que les jobs encore en attente soient exécutés avant l'arrêt
+        return self.slots.run(self._stop)
+
+    def _stop(self):
+        self.queue.put(None)
+        return threads.deferToThread(self.thread.join)
+
+
+def log_failure(failure, message):
+    logger.error(message, exc_info=(failure.type, failure.value, failure.getTracebackObject()))
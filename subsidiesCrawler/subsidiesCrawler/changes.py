@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+
+
+def record_key(row, programme):
+    # Identité stable d'une subvention dans une commune : ne dépend pas de son contenu
+    parts = [
+        str(row['postal_code']), row['commune_name'], row['profile'], row['field'],
+        programme['contributor_url'] or programme['contributor_name'] or '', programme['title'] or '',
+    ]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def diff_values(old, new, path=''):
+    # Différences champ par champ entre deux objets JSON ; les listes sont comparées en bloc
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(old.keys() | new.keys()):
+            subpath = f'{path}.{key}' if path else key
+            if key not in old:
+                yield {'path': subpath, 'new': new[key]}
+            elif key not in new:
+                yield {'path': subpath, 'old': old[key]}
+            else:
+                yield from diff_values(old[key], new[key], subpath)
+    elif old != new:
+        yield {'path': path, 'old': old, 'new': new}
+
+
+class ChangeFeed:
+    """Streaming diff between the previous and the current commune -> programme links.
+
+    ``expect`` receives the previous links of every commune page the crawl
+    refreshed, ``observe`` the current ones, both grouped by record_key so
+    the comparison is a single pass with dictionary lookups. Several
+    subsidies may share a key (same contributor and title, e.g. two amount
+    tiers): links with an identical programme_id cancel out, the others
+    are paired per key in finish(). ``programme`` returns the contributor,
+    title and payload of a programme_id. Events are kept in memory and
+    appended to a JSON lines file by write(), once the index update they
+    describe is committed:
+
+    - added: the subsidy is new for this commune
+    - modified: same contributor and title, different content, with the
+      field-level differences of the payloads
+    - removed: a previous subsidy that the refreshed commune lost
+    """
+
+    def __init__(self, path, programme):
+        self.path = path
+        self.programme = programme
+        # record_key -> liens précédents / liens nouveaux sans équivalent identique
+        self.previous = {}
+        self.unmatched = {}
+        self.seen = set()
+        self.counts = Counter()
+        self.events = []
+
+    def expect(self, row):
+        key = record_key(row, self.programme(row['programme_id']))
+        self.previous.setdefault(key, []).append(row)
+
+    def observe(self, row):
+        key = record_key(row, self.programme(row['programme_id']))
+        if (key, row['programme_id']) in self.seen:
+            return
+        self.seen.add((key, row['programme_id']))
+        previous = self.previous.get(key, ())
+        for i, old in enumerate(previous):
+            if old['programme_id'] == row['programme_id']:
+                # Inchangé
+                del previous[i]
+                return
+        self.unmatched.setdefault(key, []).append(row)
+
+    def finish(self):
+        for key, rows in self.unmatched.items():
+            previous = self.previous.pop(key, [])
+            # Appariement déterministe des liens restants d'une même clé
+            rows.sort(key=lambda row: row['programme_id'])
+            previous.sort(key=lambda row: row['programme_id'])
+            for old, row in zip(previous, rows):
+                self.modified(key, old, row)
+            for row in rows[len(previous):]:
+                self.emit('added', key, row, self.programme(row['programme_id']))
+            for old in previous[len(rows):]:
+                self.emit('removed', key, old, self.programme(old['programme_id']))
+        for key, rows in self.previous.items():
+            for old in rows:
+                self.emit('removed', key, old, self.programme(old['programme_id']))
+        self.previous, self.unmatched, self.seen = {}, {}, set()
+        return dict(self.counts)
+
+    def write(self):
+        if not self.events:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in self.events))
+        self.events = []
+
+    def modified(self, key, old, row):
+        programme = self.programme(row['programme_id'])
+        changes = list(diff_values(
+            json.loads(self.programme(old['programme_id'])['payload'] or 'null'),
+            json.loads(programme['payload'] or 'null'),
+        ))
+        self.emit('modified', key, row, programme, previous_programme_id=old['programme_id'], changes=changes)
+
+    def emit(self, event, key, row, programme, **extra):
+        self.counts[event] += 1
+        record = {
+            'event': event,
+            'key': key,
+            'timestamp': time.time(),
+            'postal_code': str(row['postal_code']),
+            'commune_name': row['commune_name'],
+            'canton': row.get('canton'),
+            'profile': row['profile'],
+            'category': row.get('category'),
+            'field': row['field'],
+            'programme_id': row['programme_id'],
+            'contributor_name': programme['contributor_name'],
+            'contributor_url': programme['contributor_url'],
+            'title': programme['title'],
+            **extra,
+        }
+        self.events.append(record)
@@ -0,0 +1,95 @@
+import csv
+import json
+import os
+import sys
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+from subsidiesCrawler.index import FILTERS, LOOKUP_COLUMNS, SubsidyIndex
+
+
+FILTER_HELP = {
+    "postal_code": "code postal de la commune",
+    "commune": "nom exact de la commune",
+    "canton": "canton (VD, GE...)",
+    "profile": "profil francsenergie.ch (building/personal...)",
+    "category": "catégorie de SUBSIDIES_FILTER_RULES",
+    "programme_id": "identifiant du programme",
+    "contributor": "nom exact du contributeur",
+}
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {"LOG_ENABLED": False}
+
+    def syntax(self):
+        return "query|export|communes|build [options]"
+
+    def short_desc(self):
+        return "Interroger, exporter ou reconstruire l'index local des subventions"
+
+    def long_desc(self):
+        return (
+            "query     affiche les subventions correspondant aux filtres (JSON lines)\n"
+            "export    écrit les subventions correspondantes dans --output (CSV ou JSON lines)\n"
+            "communes  liste les communes proposant --programme-id\n"
+            "build     reconstruit l'index en rejouant tous les crawls de SUBSIDIES_OUTPUT_DIR"
+        )
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--index", help="index SQLite (défaut : SUBSIDIES_INDEX_PATH)")
+        for name in FILTERS:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help=FILTER_HELP.get(name))
+        parser.add_argument("--limit", type=int, help="nombre maximal de lignes")
+        parser.add_argument("--output", "-o", help="fichier de sortie pour export (.csv ou .jsonl)")
+        parser.add_argument("--timing", action="store_true", help="afficher la durée de la requête")
+
+    def run(self, args, opts):
+        if len(args) != 1 or args[0] not in ("query", "export", "communes", "build"):
+            raise UsageError()
+        action = args[0]
+        path = opts.index or self.settings.get("SUBSIDIES_INDEX_PATH")
+        if not path:
+            raise UsageError("Aucun index : SUBSIDIES_INDEX_PATH est désactivé, préciser --index")
+        # Options obligatoires vérifiées avant d'ouvrir l'index
+        if action == "communes" and not opts.programme_id:
+            raise UsageError("communes : --programme-id est obligatoire")
+        if action == "export" and not opts.output:
+            raise UsageError("export : --output est obligatoire")
+        if action == "build":
+            index = SubsidyIndex(path)
+            runs = index.rebuild(self.settings.get("SUBSIDIES_OUTPUT_DIR"))
+            index.close()
+            print(f"{runs} crawl(s) rejoué(s) dans {path}")
+            return
+
+        if not os.path.exists(path):
+            raise UsageError(f"Index introuvable : {path} (le créer avec `scrapy subsidies build`)")
+        index = SubsidyIndex(path, readonly=True)
+        filters = {name: getattr(opts, name) for name in FILTERS}
+        start = time.perf_counter()
+        if action == "communes":
+            rows = index.communes_offering(opts.programme_id)
+        else:
+            rows = index.lookup(limit=opts.limit, **filters)
+        elapsed = time.perf_counter() - start
+        index.close()
+
+        if action == "export":
+            with open(opts.output, "w", encoding="utf-8", newline="") as f:
+                if opts.output.endswith(".csv"):
+                    writer = csv.DictWriter(f, fieldnames=LOOKUP_COLUMNS)
+                    writer.writeheader()
+                    writer.writerows(rows)
+                else:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            for row in rows:
+                sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        if opts.timing:
+            sys.stderr.write(f"{len(rows)} ligne(s) en {elapsed * 1000:.3f} ms\n")
@@ -0,0 +1,166 @@
+# Define here your custom extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import cProfile
+import json
+from collections import Counter, defaultdict
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import threads
+
+
+class StageStats:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': round(self.total, 6),
+            'mean_ms': round(1000 * self.total / self.count, 3) if self.count else 0.0,
+            'max_ms': round(1000 * self.max, 3),
+        }
+
+
+class CrawlInstrumentation:
+    """Per-stage timings, per-commune outcomes and an optional profiler.
+
+    Download latency and HTTP errors are taken from the responses; the
+    spider and the pipeline report their own stages (parse, filter,
+    pipeline_process, pipeline_write) and commune outcomes through
+    ``spider.instrumentation``. At close, totals go to the crawl stats and
+    to JSON / Prometheus text files with the slowest communes.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.json_path = settings.get('INSTRUMENTATION_JSON_PATH')
+        self.prometheus_path = settings.get('INSTRUMENTATION_PROMETHEUS_PATH')
+        self.top_n = settings.getint('INSTRUMENTATION_TOP_N', 20)
+        self.profile_path = settings.get('INSTRUMENTATION_PROFILE_PATH') if settings.getbool('INSTRUMENTATION_PROFILE') else None
+        self.profiler = None
+        self.stages = defaultdict(StageStats)
+        self.outcomes = Counter()
+        self.communes = defaultdict(dict)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INSTRUMENTATION_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        return ext
+
+    @staticmethod
+    def commune_key(meta):
+        if meta is None or 'commune_name' not in meta:
+            return None
+        return (str(meta['postal_code']), meta['commune_name'], meta.get('profile'))
+
+    def record(self, stage, seconds, meta=None):
+        self.stages[stage].add(seconds)
+        key = self.commune_key(meta)
+        if key is not None:
+            commune = self.communes[key]
+            commune[stage] = commune.get(stage, 0.0) + seconds
+
+    def outcome(self, name, meta=None):
+        self.outcomes[name] += 1
+        key = self.commune_key(meta)
+        if key is not None:
+            self.communes[key]['outcome'] = name
+
+    def spider_opened(self, spider):
+        spider.instrumentation = self
+        if self.profile_path:
+            # cProfile ne voit que le thread du reactor (parse, filtres, pipeline)
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.record('download', latency, request.meta)
+        # robots.txt et autres requêtes hors communes : pas d'outcome
+        if response.status >= 400 and self.commune_key(request.meta) is not None:
+            self.outcome('http_error', request.meta)
+
+    def slowest(self):
+        rows = []
+        for (postal_code, commune_name, profile), timings in self.communes.items():
+            total = sum(value for value in timings.values() if isinstance(value, float))
+            row = {'postal_code': postal_code, 'commune_name': commune_name, 'profile': profile, 'total_seconds': round(total, 6)}
+            row.update((name, round(value, 6) if isinstance(value, float) else value) for name, value in timings.items())
+            rows.append(row)
+        rows.sort(key=lambda row: row['total_seconds'], reverse=True)
+        return rows[:self.top_n]
+
+    def spider_closed(self, spider, reason):
+        if self.profiler is not None:
+            self.profiler.disable()
+        stages = {stage: stats.as_dict() for stage, stats in self.stages.items()}
+        for stage, values in stages.items():
+            for name, value in values.items():
+                self.stats.set_value(f'instrumentation/{stage}/{name}', value)
+        for name, count in self.outcomes.items():
+            self.stats.set_value(f'instrumentation/outcome/{name}', count)
+        report = {
+            'reason': reason,
+            'stages': stages,
+            'outcomes': dict(self.outcomes),
+            'slowest_communes': self.slowest(),
+        }
+        for commune in report['slowest_communes'][:5]:
+            spider.logger.info("Commune lente : %(commune_name)s (%(postal_code)s) %(total_seconds).3fs", commune)
+        # Écriture des rapports hors du thread du reactor
+        return threads.deferToThread(self.write_reports, report)
+
+    def write_reports(self, report):
+        if self.json_path:
+            with open(self.json_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=4)
+        if self.prometheus_path:
+            with open(self.prometheus_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text(report))
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.profile_path)
+
+    @staticmethod
+    def prometheus_text(report):
+        lines = [
+            '# HELP subsidies_crawl_stage_seconds_total Time spent per crawl stage.',
+            '# TYPE subsidies_crawl_stage_seconds_total counter',
+        ]
+        lines += [f'subsidies_crawl_stage_seconds_total{{stage="{stage}"}} {values["total_seconds"]}' for stage, values in report['stages'].items()]
+        lines += [
+            '# HELP subsidies_crawl_stage_calls_total Number of timed calls per crawl stage.',
+            '# TYPE subsidies_crawl_stage_calls_total counter',
+        ]
+        lines += [f'subsidies_crawl_stage_calls_total{{stage="{stage}"}} {values["count"]}' for stage, values in report['stages'].items()]
+        lines += [
+            '# HELP subsidies_crawl_stage_max_seconds Slowest call per crawl stage.',
+            '# TYPE subsidies_crawl_stage_max_seconds gauge',
+        ]
+        lines += [f'subsidies_crawl_stage_max_seconds{{stage="{stage}"}} {values["max_ms"] / 1000}' for stage, values in report['stages'].items()]
+        lines += [
+            '# HELP subsidies_crawl_outcomes_total Commune pages per outcome.',
+            '# TYPE subsidies_crawl_outcomes_total counter',
+        ]
+        lines += [f'subsidies_crawl_outcomes_total{{outcome="{name}"}} {count}' for name, count in report['outcomes'].items()]
+        return '\n'.join(lines) + '\n'
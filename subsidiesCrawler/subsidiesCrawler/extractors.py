@@ -0,0 +1,74 @@
+import html
+import json
+import re
+
+from parsel import Selector
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+SUBSIDIES_MARKER = b'data-svelte-component="subsidies"'
+# Présent dès qu'un composant Svelte est rendu, quelle que soit l'écriture de l'attribut
+COMPONENT_ATTRIBUTE = b'data-svelte-component'
+SUBSIDIES_CSS = 'div[data-svelte-component="subsidies"]::attr(data-svelte-props)'
+
+# Balise ouvrante complète, y compris les valeurs d'attributs contenant '>'
+_OPEN_TAG_RE = re.compile(rb'<div\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>', re.IGNORECASE)
+_PROPS_RE = re.compile(rb'\sdata-svelte-props\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# Entités produites par l'échappement d'un JSON dans un attribut ; &amp; est traité en dernier
+_COMMON_ENTITIES = (
+    (b'&quot;', b'"'), (b'&#34;', b'"'), (b'&#39;', b"'"), (b'&#x27;', b"'"), (b'&lt;', b'<'), (b'&gt;', b'>'),
+)
+
+
+def extract_subsidies_props(body, encoding='utf-8'):
+    """Return the unescaped data-svelte-props of the subsidies component.
+
+    Scans the raw bytes for the component marker and reads the attribute
+    from its opening tag, without building a DOM. Falls back to a full
+    parsel selection when the tag cannot be read that way, or when a
+    component is present but the marker is written differently (single
+    quotes, spaces around '='). Returns None when the page has no
+    subsidies component.
+    """
+    pos = body.find(SUBSIDIES_MARKER)
+    if pos == -1:
+        if body.find(COMPONENT_ATTRIBUTE) == -1:
+            return None
+        return _select_props(body, encoding)
+    start = body.rfind(b'<', 0, pos)
+    tag = _OPEN_TAG_RE.match(body, start) if start != -1 else None
+    if tag is not None and tag.end() > pos:
+        props = _PROPS_RE.search(tag.group())
+        if props is not None:
+            value = props.group(1) if props.group(1) is not None else props.group(2)
+            return _unescape(value, encoding)
+    # Cas inhabituel (attribut contenant '<', balise mal formée...) : parsing complet
+    return _select_props(body, encoding)
+
+
+def _unescape(value, encoding):
+    # bytes.replace est bien plus rapide que html.unescape sur un attribut rempli de &quot;
+    if b'&' not in value:
+        return value.decode(encoding)
+    unescaped = value
+    for entity, char in _COMMON_ENTITIES:
+        unescaped = unescaped.replace(entity, char)
+    if unescaped.count(b'&') == unescaped.count(b'&amp;'):
+        return unescaped.replace(b'&amp;', b'&').decode(encoding)
+    # Autres entités (&eacute;, &#233;, sans point-virgule...) : cas général
+    return html.unescape(value.decode(encoding))
+
+
+def _select_props(body, encoding):
+    return Selector(text=body.decode(encoding, 'replace')).css(SUBSIDIES_CSS).get()
+
+
+def loads(text):
+    # orjson s'il est installé, sinon le module json standard
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import unicodedata
+from collections import Counter
+from urllib.parse import urlsplit
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+_APOSTROPHES = str.maketrans({'’': "'", '‘': "'", '`': "'", '´': "'"})
+
+
+def normalize_name(name):
+    # Comparaison sans casse, sans accents et quel que soit le type d'apostrophe
+    name = unicodedata.normalize('NFKD', name.translate(_APOSTROPHES))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(name.casefold().split())
+
+
+def load_rules(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ImportError(f"PyYAML est nécessaire pour lire {path}")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+class HostRules:
+    """Host-suffix lookup: each suffix maps to the name of its rule.
+
+    A URL is matched by looking up its host and each of its parent
+    domains, so the cost depends on the number of labels in the host,
+    not on the number of rules.
+    """
+
+    def __init__(self, rules):
+        self.suffixes = {}
+        for rule_name, hosts in rules.items():
+            for host in hosts:
+                self.suffixes[host.lower().strip('.')] = rule_name
+
+    def __bool__(self):
+        return bool(self.suffixes)
+
+    def match(self, host):
+        if not host or not self.suffixes:
+            return None
+        labels = host.split('.')
+        for i in range(len(labels) - 1):
+            rule_name = self.suffixes.get('.'.join(labels[i:]))
+            if rule_name is not None:
+                return rule_name
+        return None
+
+
+class SubsidyFilter:
+    """Field categories and contributor include/exclude rules.
+
+    The rules are compiled once: field names become a dictionary keyed by
+    their normalised form, contributor hosts become HostRules per
+    category. Global include/exclude rules apply to every category.
+
+    Rules format::
+
+        {
+            "exclude": {"rule name": ["host.suffix", ...]},
+            "categories": {
+                "electricity": {
+                    "fields": ["Production d’électricité"],
+                    "include": {"rule name": ["host.suffix", ...]},
+                    "exclude": {"rule name": ["host.suffix", ...]},
+                },
+            },
+        }
+
+    When a category has include rules, only contributors matching one of
+    them are kept; exclude rules are applied afterwards.
+    """
+
+    def __init__(self, rules, categories=None):
+        if categories:
+            unknown = set(categories) - set(rules.get('categories', {}))
+            if unknown:
+                raise ValueError(f"Catégories inconnues : {', '.join(sorted(unknown))}")
+            rules = {**rules, 'categories': {name: rules['categories'][name] for name in categories}}
+        # Change quand les règles changent : invalide les empreintes du crawl incrémental
+        self.digest = hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()
+        self.fields = {}
+        self.include = {}
+        self.exclude = {}
+        for category, config in rules.get('categories', {}).items():
+            for field_name in config.get('fields', []):
+                self.fields[normalize_name(field_name)] = category
+            self.include[category] = HostRules({**rules.get('include', {}), **config.get('include', {})})
+            self.exclude[category] = HostRules({**rules.get('exclude', {}), **config.get('exclude', {})})
+        self.hits = Counter()
+
+    @classmethod
+    def from_settings(cls, settings, categories=None):
+        path = settings.get('SUBSIDIES_FILTER_RULES_FILE')
+        rules = load_rules(path) if path else settings.getdict('SUBSIDIES_FILTER_RULES')
+        return cls(rules, categories)
+
+    @property
+    def categories(self):
+        return list(self.include)
+
+    def category(self, field_name):
+        return self.fields.get(normalize_name(field_name))
+
+    def keep(self, category, url):
+        try:
+            host = urlsplit(url).hostname if url else None
+        except ValueError:
+            # URL mal formée (ex. "https://[::1/") : traitée comme une URL sans hôte
+            host = None
+        include = self.include[category]
+        if include:
+            rule_name = include.match(host)
+            if rule_name is None:
+                self.hits[f'{category}/not_included'] += 1
+                return False
+            self.hits[f'{category}/include/{rule_name}'] += 1
+        rule_name = self.exclude[category].match(host)
+        if rule_name is not None:
+            self.hits[f'{category}/exclude/{rule_name}'] += 1
+            return False
+        self.hits[f'{category}/kept'] += 1
+        return True
+
+    def select(self, fields):
+        # Renvoie (catégorie, nom du champ, subvention) pour chaque subvention retenue
+        for field in fields:
+            category = self.category(field['name'])
+            if category is None:
+                continue
+            for subsidy in field.get('subsidies', []):
+                url = (subsidy.get('contributor') or {}).get('url')
+                if self.keep(category, url):
+                    yield category, field['name'], subsidy
+
+    def export_stats(self, stats, prefix='filter'):
+        for key, count in self.hits.items():
+            stats.set_value(f'{prefix}/{key}', count)
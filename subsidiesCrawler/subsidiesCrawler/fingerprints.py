@@ -0,0 +1,125 @@
+import hashlib
+import sqlite3
+import time
+
+from subsidiesCrawler.background import log_failure
+
+
+def content_hash(*parts):
+    # Empreinte du contenu de l'attribut data-svelte-props (et des règles qui lui sont appliquées)
+    digest = hashlib.sha256()
+    for data in parts:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class FingerprintStore:
+    """Persistent per-commune fingerprints used by the incremental crawl.
+
+    Each (postal_code, commune_name, profile) key keeps the ETag and
+    Last-Modified validators of the last response together with the hash
+    of its data-svelte-props payload. Lookups are served from memory;
+    when a BackgroundWriter is given, SQLite writes run on its thread.
+    """
+
+    commit_every = 100
+
+    def __init__(self, path, writer=None):
+        self.path = path
+        self.writer = writer
+        # timeout : plusieurs processus (tranches) peuvent partager la même base
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " postal_code TEXT NOT NULL,"
+            " commune_name TEXT NOT NULL,"
+            " profile TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " content_hash TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (postal_code, commune_name, profile))"
+        )
+        self.conn.commit()
+        # Tout est chargé en mémoire : quelques milliers de lignes au plus
+        self.entries = {
+            (postal_code, commune_name, profile): (etag, last_modified, digest)
+            for postal_code, commune_name, profile, etag, last_modified, digest in self.conn.execute(
+                "SELECT postal_code, commune_name, profile, etag, last_modified, content_hash FROM pages"
+            )
+        }
+        self._pending = 0
+
+    @staticmethod
+    def key(postal_code, commune_name, profile):
+        return (str(postal_code), commune_name, profile)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def conditional_headers(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return {}
+        etag, last_modified, _ = entry
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def update(self, key, etag, last_modified, digest):
+        self.entries[key] = (etag, last_modified, digest)
+        self._execute(
+            "INSERT OR REPLACE INTO pages"
+            " (postal_code, commune_name, profile, etag, last_modified, content_hash, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*key, etag, last_modified, digest, time.time()),
+        )
+
+    def delete(self, key):
+        if self.entries.pop(key, None) is None:
+            return
+        self._execute(
+            "DELETE FROM pages WHERE postal_code = ? AND commune_name = ? AND profile = ?", key
+        )
+
+    def _execute(self, sql, params):
+        self._pending += 1
+        commit = self._pending >= self.commit_every
+        if commit:
+            self._pending = 0
+        self._run(self._write, sql, params, commit)
+
+    def _write(self, sql, params, commit):
+        self.conn.execute(sql, params)
+        if commit:
+            self.conn.commit()
+
+    def _run(self, fn, *args):
+        if self.writer is None:
+            return fn(*args)
+        d = self.writer.submit(fn, *args)
+        d.addErrback(log_failure, f"Échec d'écriture dans {self.path}")
+        return d
+
+    def commit(self):
+        self._pending = 0
+        return self._run(self.conn.commit)
+
+    def close(self):
+        return self._run(self._close)
+
+    def _close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,225 @@
+import glob
+import json
+import os
+import sqlite3
+
+import pyarrow.parquet as pq
+
+
+COMMUNE_KEY = ('postal_code', 'commune_name', 'profile')
+
+LOOKUP_COLUMNS = (
+    'postal_code', 'commune_name', 'canton', 'profile', 'category', 'field', 'programme_id',
+    'contributor_name', 'contributor_url', 'title', 'amounts', 'conditions', 'payload',
+)
+
+# Filtres de lookup() -> colonne SQL
+FILTERS = {
+    'postal_code': 'cp.postal_code',
+    'commune': 'cp.commune_name',
+    'canton': 'cp.canton',
+    'profile': 'cp.profile',
+    'category': 'cp.category',
+    'programme_id': 'cp.programme_id',
+    'contributor': 'p.contributor_name',
+}
+
+
+def read_rows(path):
+    # Lecture en flux d'un fichier produit par SubsidiescrawlerPipeline
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def dataset_files(output_dir, name):
+    # Triés par nom, donc par run puis par ordre d'écriture
+    return sorted(
+        glob.glob(os.path.join(output_dir, f"{name}-*.parquet"))
+        + glob.glob(os.path.join(output_dir, f"{name}-*.jsonl"))
+    )
+
+
+class SubsidyIndex:
+    """SQLite index of the crawled subsidies.
+
+    Keeps the programmes and commune -> programme tables of the pipeline
+    output, indexed by postal code, commune, canton, category and
+    contributor, and is updated in place after every crawl so that
+    incremental runs only touch the communes they refreshed.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.programmes = {}
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            # timeout : plusieurs tranches peuvent mettre l'index à jour en même temps
+            self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.create_schema()
+        self.conn.row_factory = sqlite3.Row
+
+    def create_schema(self):
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS programmes (
+                programme_id TEXT PRIMARY KEY,
+                contributor_name TEXT,
+                contributor_url TEXT,
+                title TEXT,
+                amounts TEXT,
+                conditions TEXT,
+                payload TEXT
+            );
+            CREATE TABLE IF NOT EXISTS commune_programmes (
+                postal_code TEXT NOT NULL,
+                commune_name TEXT NOT NULL,
+                canton TEXT,
+                profile TEXT NOT NULL,
+                category TEXT,
+                field TEXT NOT NULL,
+                programme_id TEXT NOT NULL,
+                PRIMARY KEY (postal_code, commune_name, profile, field, programme_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS commune_programmes_commune ON commune_programmes (commune_name);
+            CREATE INDEX IF NOT EXISTS commune_programmes_canton ON commune_programmes (canton);
+            CREATE INDEX IF NOT EXISTS commune_programmes_category ON commune_programmes (category, postal_code);
+            CREATE INDEX IF NOT EXISTS commune_programmes_programme ON commune_programmes (programme_id);
+            CREATE INDEX IF NOT EXISTS programmes_contributor ON programmes (contributor_name);
+            """
+        )
+
+    def update(self, programme_files, link_files, refreshed=(), changes=None):
+        """Apply one crawl's output files.
+
+        Every commune page in ``refreshed`` (dicts with postal_code,
+        commune_name, profile and the list of crawled categories) and
+        every commune present in the files has its previous links of those
+        categories replaced by those of the files, so pages that lost all
+        their subsidies are emptied too while the links of categories the
+        crawl did not select are kept. With ``changes``
+        (a subsidiesCrawler.changes.ChangeFeed), the replaced and new links
+        are compared on the way and the differences written to the feed
+        once the transaction is committed.
+        """
+        with self.conn:
+            cleared = set()
+            for page in refreshed:
+                for category in page['categories']:
+                    self._clear(page, category, cleared, changes)
+            for path in programme_files:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO programmes"
+                    " (programme_id, contributor_name, contributor_url, title, amounts, conditions, payload)"
+                    " VALUES (:programme_id, :contributor_name, :contributor_url, :title, :amounts, :conditions, :payload)",
+                    read_rows(path),
+                )
+            for path in link_files:
+                for row in read_rows(path):
+                    self._clear(row, row['category'], cleared, changes)
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO commune_programmes"
+                        " (postal_code, commune_name, canton, profile, category, field, programme_id)"
+                        " VALUES (:postal_code, :commune_name, :canton, :profile, :category, :field, :programme_id)",
+                        row,
+                    )
+                    if changes is not None:
+                        changes.observe(row)
+            if changes is not None:
+                # Avant la suppression des programmes orphelins, encore nécessaires aux événements "removed"
+                changes.finish()
+            # Programmes qui ne sont plus proposés par aucune commune
+            self.conn.execute(
+                "DELETE FROM programmes WHERE programme_id NOT IN (SELECT programme_id FROM commune_programmes)"
+            )
+        if changes is not None:
+            # Seulement une fois la transaction validée : un rollback ne laisse pas d'événements orphelins
+            changes.write()
+        return len({key[:-1] for key in cleared})
+
+    def _clear(self, commune, category, cleared, changes=None):
+        # Seuls les liens de la catégorie sont remplacés : un crawl -a categories=... ne touche pas aux autres
+        key = (*(str(commune[column]) for column in COMMUNE_KEY), category)
+        if key in cleared:
+            return
+        cleared.add(key)
+        where = " WHERE postal_code = ? AND commune_name = ? AND profile = ? AND category IS ?"
+        if changes is not None:
+            for row in self.conn.execute("SELECT * FROM commune_programmes" + where, key):
+                changes.expect(dict(row))
+        self.conn.execute("DELETE FROM commune_programmes" + where, key)
+
+    def rebuild(self, output_dir):
+        # Rejoue tous les fichiers du dossier de sortie, du plus ancien au plus récent,
+        # avec la liste des pages relues par chaque crawl (fichiers refreshed-*)
+        with self.conn:
+            self.conn.execute("DELETE FROM commune_programmes")
+            self.conn.execute("DELETE FROM programmes")
+        runs = {}
+        for name in ('programmes', 'commune_programmes', 'refreshed'):
+            for path in dataset_files(output_dir, name):
+                run_id = os.path.basename(path)[len(name) + 1:].rsplit('-', 1)[0]
+                runs.setdefault(run_id, {'programmes': [], 'commune_programmes': [], 'refreshed': []})[name].append(path)
+        for run_id in sorted(runs):
+            # Pages relues par ce crawl, y compris celles restées vides (404, pas de JSON, plus de subvention)
+            refreshed = (page for path in runs[run_id]['refreshed'] for page in read_rows(path))
+            self.update(runs[run_id]['programmes'], runs[run_id]['commune_programmes'], refreshed)
+        return len(runs)
+
+    def lookup(self, limit=None, **filters):
+        """Subsidies matching all the given filters, one dict per commune/programme.
+
+        Filters: postal_code, commune, canton, profile, category,
+        programme_id, contributor (exact contributor name).
+        """
+        clauses, params = [], []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in FILTERS:
+                raise ValueError(f"Filtre inconnu : {name}")
+            clauses.append(f"{FILTERS[name]} = ?")
+            params.append(str(value))
+        sql = (
+            "SELECT cp.postal_code, cp.commune_name, cp.canton, cp.profile, cp.category, cp.field, cp.programme_id,"
+            " p.contributor_name, p.contributor_url, p.title, p.amounts, p.conditions, p.payload"
+            " FROM commune_programmes cp JOIN programmes p ON p.programme_id = cp.programme_id"
+        )
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY cp.postal_code, cp.commune_name, cp.category, p.contributor_name"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def programme(self, programme_id):
+        # Cache : un même programme est proposé par de nombreuses communes
+        programme = self.programmes.get(programme_id)
+        if programme is None:
+            row = self.conn.execute(
+                "SELECT contributor_name, contributor_url, title, payload FROM programmes WHERE programme_id = ?",
+                (programme_id,),
+            ).fetchone()
+            programme = dict(row) if row is not None else dict.fromkeys(('contributor_name', 'contributor_url', 'title', 'payload'))
+            self.programmes[programme_id] = programme
+        return programme
+
+    def communes_offering(self, programme_id):
+        return [
+            dict(row) for row in self.conn.execute(
+                "SELECT DISTINCT postal_code, commune_name, canton FROM commune_programmes"
+                " WHERE programme_id = ? ORDER BY postal_code, commune_name",
+                (programme_id,),
+            )
+        ]
+
+    def close(self):
+        self.conn.close()
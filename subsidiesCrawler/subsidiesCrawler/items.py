@@ -7,6 +7,19 @@ import scrapy
 
 
 class SubsidiescrawlerItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # Une subvention d'une commune, normalisée par SubsidiescrawlerPipeline
+    commune_name = scrapy.Field()
+    postal_code = scrapy.Field()
+    canton = scrapy.Field()
+    profile = scrapy.Field()
+    category = scrapy.Field()
+    field = scrapy.Field()
+    # Empreinte du contenu de la subvention, partagée par toutes les communes qui l'offrent
+    programme_id = scrapy.Field()
+    contributor_name = scrapy.Field()
+    contributor_url = scrapy.Field()
+    title = scrapy.Field()
+    # Objets JSON imbriqués, sérialisés en chaînes pour garder un schéma stable
+    amounts = scrapy.Field()
+    conditions = scrapy.Field()
+    payload = scrapy.Field()
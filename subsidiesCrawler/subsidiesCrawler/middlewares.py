@@ -3,7 +3,13 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import random
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -56,48 +62,148 @@ class SubsidiescrawlerSpiderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
-class SubsidiescrawlerDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+class DomainThrottle:
+    # État du contrôleur pour un slot de téléchargement (un domaine)
+
+    def __init__(self, window, delay, concurrency):
+        self.latencies = deque(maxlen=window)
+        self.errors = deque(maxlen=window)
+        self.delay = delay
+        self.concurrency = concurrency
+        self.failures = 0
+
+    @property
+    def latency(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    @property
+    def error_rate(self):
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+
+class AdaptiveThrottleMiddleware:
+    """Per-domain concurrency and delay driven by observed latency and errors.
+
+    Each download slot keeps a rolling window of latencies and failures
+    (429, 5xx, download exceptions). Healthy windows raise concurrency by
+    one and shrink the delay; slow windows lower concurrency; failures
+    halve concurrency and back off exponentially with jitter, never below
+    the server's Retry-After. Must sit before RetryMiddleware (550) in the
+    response chain to see the responses it retries.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.window = settings.getint('ADAPTIVE_THROTTLE_WINDOW', 50)
+        self.target_latency = settings.getfloat('ADAPTIVE_THROTTLE_TARGET_LATENCY', 1.0)
+        self.max_error_rate = settings.getfloat('ADAPTIVE_THROTTLE_MAX_ERROR_RATE', 0.05)
+        self.start_delay = settings.getfloat('ADAPTIVE_THROTTLE_START_DELAY', settings.getfloat('DOWNLOAD_DELAY'))
+        self.min_delay = settings.getfloat('ADAPTIVE_THROTTLE_MIN_DELAY', 0.0)
+        self.max_delay = settings.getfloat('ADAPTIVE_THROTTLE_MAX_DELAY', 60.0)
+        self.backoff_base = settings.getfloat('ADAPTIVE_THROTTLE_BACKOFF_BASE', 1.0)
+        self.start_concurrency = settings.getint('ADAPTIVE_THROTTLE_START_CONCURRENCY', 2)
+        self.max_concurrency = settings.getint('ADAPTIVE_THROTTLE_MAX_CONCURRENCY', settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'))
+        self.error_codes = {int(code) for code in settings.getlist('ADAPTIVE_THROTTLE_ERROR_CODES', [429, 500, 502, 503, 504])}
+        self.domains = {}
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        if not crawler.settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        if crawler.settings.getbool('AUTOTHROTTLE_ENABLED'):
+            raise NotConfigured("AdaptiveThrottleMiddleware et AutoThrottle ne peuvent pas être actifs en même temps")
+        s = cls(crawler)
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
-    def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
-
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        slot_key, slot = self._slot(request)
+        if slot is None:
+            return response
+        if int(response.status) in self.error_codes:
+            self._failure(slot_key, slot, self._retry_after(response))
+        else:
+            self._success(slot_key, slot, request.meta.get('download_latency'))
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
-
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+        slot_key, slot = self._slot(request)
+        if slot is not None:
+            self._failure(slot_key, slot, None)
+
+    def _slot(self, request):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key) if key is not None else None
+        if slot is not None and key not in self.domains:
+            self.domains[key] = DomainThrottle(
+                self.window,
+                max(self.min_delay, self.start_delay),
+                max(1, min(self.start_concurrency, self.max_concurrency)),
+            )
+        return key, slot
+
+    def _success(self, key, slot, latency):
+        state = self.domains[key]
+        state.failures = 0
+        state.errors.append(0)
+        if latency is not None:
+            state.latencies.append(latency)
+        if state.error_rate <= self.max_error_rate and state.latency <= self.target_latency:
+            # Augmentation additive
+            state.concurrency = min(self.max_concurrency, state.concurrency + 1)
+            state.delay = max(self.min_delay, state.delay * 0.9)
+        elif state.latency > self.target_latency:
+            state.concurrency = max(1, state.concurrency - 1)
+        self._apply(key, slot, state)
+
+    def _failure(self, key, slot, retry_after):
+        state = self.domains[key]
+        state.failures += 1
+        state.errors.append(1)
+        # Diminution multiplicative et attente exponentielle avec jitter
+        state.concurrency = max(1, state.concurrency // 2)
+        backoff = self.backoff_base * 2 ** (state.failures - 1) * random.uniform(0.5, 1.5)
+        state.delay = min(self.max_delay, max(state.delay, backoff))
+        if retry_after is not None:
+            # Plafonné : une date lointaine ne doit pas bloquer le domaine pour le reste du crawl
+            state.delay = max(state.delay, min(self.max_delay, retry_after))
+            self.stats.inc_value('adaptive_throttle/retry_after')
+        self.stats.inc_value('adaptive_throttle/backoffs')
+        self._apply(key, slot, state)
+
+    def _apply(self, key, slot, state):
+        slot.delay = state.delay
+        slot.concurrency = state.concurrency
+        self.stats.set_value(f'adaptive_throttle/{key}/delay', round(state.delay, 3))
+        self.stats.set_value(f'adaptive_throttle/{key}/concurrency', state.concurrency)
+        self.stats.set_value(f'adaptive_throttle/{key}/latency', round(state.latency, 3))
+        self.stats.set_value(f'adaptive_throttle/{key}/error_rate', round(state.error_rate, 3))
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        value = value.decode('latin-1').strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            # Dates en -0000 : UTC sans fuseau explicite
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
 
     def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+        # Lus par le downloader à la création de chaque slot : la première vague de requêtes
+        # d'un domaine part déjà au rythme de départ, avant toute réponse (comme AutoThrottle)
+        spider.download_delay = max(self.min_delay, self.start_delay)
+        spider.max_concurrent_requests = max(1, min(self.start_concurrency, self.max_concurrency))
+        spider.logger.info(
+            "Adaptive throttle: concurrency %d..%d, delay %.2f..%.2fs, target latency %.2fs",
+            1, self.max_concurrency, self.min_delay, self.max_delay, self.target_latency,
+        )
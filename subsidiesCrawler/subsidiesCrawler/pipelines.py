@@ -3,11 +3,338 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import hashlib
+import json
+import logging
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from twisted.internet import defer
+
+from subsidiesCrawler.background import BackgroundWriter, log_failure
+from subsidiesCrawler.changes import ChangeFeed
+from subsidiesCrawler.index import SubsidyIndex
+from subsidiesCrawler.items import SubsidiescrawlerItem
+
+logger = logging.getLogger(__name__)
+
+# Un programme de subvention, stocké une seule fois quel que soit le nombre de communes
+PROGRAMME_SCHEMA = pa.schema([
+    ('programme_id', pa.string()),
+    ('contributor_name', pa.string()),
+    ('contributor_url', pa.string()),
+    ('title', pa.string()),
+    ('amounts', pa.string()),
+    ('conditions', pa.string()),
+    ('payload', pa.string()),
+])
+
+# Lien commune -> programme
+COMMUNE_PROGRAMME_SCHEMA = pa.schema([
+    ('commune_name', pa.string()),
+    ('postal_code', pa.string()),
+    ('canton', pa.string()),
+    ('profile', pa.string()),
+    ('category', pa.string()),
+    ('field', pa.string()),
+    ('programme_id', pa.string()),
+])
+
+# Pages relues pendant le crawl, rejouées par SubsidyIndex.rebuild pour vider celles qui ont perdu leurs subventions
+REFRESHED_SCHEMA = pa.schema([
+    ('commune_name', pa.string()),
+    ('postal_code', pa.string()),
+    ('profile', pa.string()),
+    ('categories', pa.list_(pa.string())),
+])
+
+PROGRAMME_FIELDS = PROGRAMME_SCHEMA.names
+COMMUNE_PROGRAMME_FIELDS = COMMUNE_PROGRAMME_SCHEMA.names
+
+
+def _dumps(value):
+    if value is None:
+        return None
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def programme_fingerprint(payload):
+    # payload : JSON canonique (clés triées) de la subvention, contributeur compris
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def normalize_subsidy(record):
+    # record : {'commune_name', 'postal_code', 'canton', 'profile', 'category', 'field', 'subsidy'} produit par le spider
+    subsidy = record['subsidy']
+    contributor = subsidy.get('contributor') or {}
+    payload = _dumps(subsidy)
+    return SubsidiescrawlerItem(
+        commune_name=record['commune_name'],
+        postal_code=str(record['postal_code']),
+        canton=record.get('canton'),
+        profile=record.get('profile'),
+        category=record.get('category'),
+        field=record['field'],
+        programme_id=programme_fingerprint(payload),
+        contributor_name=contributor.get('name'),
+        contributor_url=contributor.get('url'),
+        title=subsidy.get('name') or subsidy.get('title'),
+        amounts=_dumps(subsidy.get('amounts', subsidy.get('amount'))),
+        conditions=_dumps(subsidy.get('conditions')),
+        payload=payload,
+    )
+
+
+class ParquetRotatingWriter:
+    extension = 'parquet'
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self.writer = pq.ParquetWriter(path, schema, compression='zstd')
+
+    def write(self, rows):
+        # Un row group par lot
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class JsonLinesRotatingWriter:
+    extension = 'jsonl'
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, rows):
+        self.file.write(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class RotatingDataset:
+    # Fichiers successifs d'un même jeu de données ; utilisé uniquement depuis le thread d'écriture
+
+    def __init__(self, name, schema, writer_cls, output_dir, run_id, rotate_rows, rotate_seconds):
+        self.name = name
+        self.schema = schema
+        self.writer_cls = writer_cls
+        self.output_dir = output_dir
+        self.run_id = run_id
+        self.rotate_rows = rotate_rows
+        self.rotate_seconds = rotate_seconds
+        self.writer = None
+        self.writer_rows = 0
+        self.writer_opened_at = 0.0
+        self.files = []
+
+    def write(self, rows):
+        if self.writer is not None and (
+            self.writer_rows >= self.rotate_rows
+            or time.monotonic() - self.writer_opened_at >= self.rotate_seconds
+        ):
+            self.close()
+        if self.writer is None:
+            self.open_writer()
+        self.writer.write(rows)
+        self.writer_rows += len(rows)
+        return len(rows)
+
+    def open_writer(self):
+        path = os.path.join(self.output_dir, f"{self.name}-{self.run_id}-{len(self.files) + 1:04d}.{self.writer_cls.extension}")
+        self.writer = self.writer_cls(path, self.schema)
+        self.writer_rows = 0
+        self.writer_opened_at = time.monotonic()
+        self.files.append(path)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
 
 class SubsidiescrawlerPipeline:
+    writers = {
+        'parquet': ParquetRotatingWriter,
+        'jsonl': JsonLinesRotatingWriter,
+    }
+
+    def __init__(self, output_dir, output_format='parquet', batch_size=500, rotate_rows=100000, rotate_seconds=3600, max_pending_batches=8, index_path=None, changes_dir=None, stats=None):
+        if output_format not in self.writers:
+            raise ValueError(f"Format de sortie inconnu : {output_format!r} (attendu : {', '.join(self.writers)})")
+        self.output_dir = output_dir
+        self.writer_cls = self.writers[output_format]
+        self.batch_size = batch_size
+        self.rotate_rows = rotate_rows
+        self.rotate_seconds = rotate_seconds
+        self.max_pending_batches = max_pending_batches
+        self.index_path = index_path
+        self.changes_dir = changes_dir
+        if changes_dir and not index_path:
+            # Le flux compare l'index avant et après sa mise à jour
+            logger.warning("SUBSIDIES_CHANGES_DIR ignoré : le flux de changements nécessite SUBSIDIES_INDEX_PATH")
+        self.stats = stats
+        # Programmes déjà vus pendant ce crawl : un seul objet par programme identique
+        self.programmes = {}
+        self.buffers = {'programmes': [], 'commune_programmes': []}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            output_dir=settings.get('SUBSIDIES_OUTPUT_DIR'),
+            output_format=settings.get('SUBSIDIES_OUTPUT_FORMAT', 'parquet'),
+            batch_size=settings.getint('SUBSIDIES_BATCH_SIZE', 500),
+            rotate_rows=settings.getint('SUBSIDIES_ROTATE_ROWS', 100000),
+            rotate_seconds=settings.getfloat('SUBSIDIES_ROTATE_SECONDS', 3600),
+            max_pending_batches=settings.getint('SUBSIDIES_MAX_PENDING_BATCHES', 8),
+            index_path=settings.get('SUBSIDIES_INDEX_PATH'),
+            changes_dir=settings.get('SUBSIDIES_CHANGES_DIR'),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        self.spider = spider
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Plusieurs processus (tranches, cantons, listes de communes) peuvent écrire en parallèle
+        # dans le même dossier et démarrer dans la même seconde : le pid rend les noms uniques
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-p{os.getpid()}"
+        shard_label = getattr(spider, 'shard_label', None)
+        if shard_label:
+            self.run_id = f"{self.run_id}-{shard_label}"
+        self.datasets = {
+            'programmes': RotatingDataset('programmes', PROGRAMME_SCHEMA, self.writer_cls, self.output_dir, self.run_id, self.rotate_rows, self.rotate_seconds),
+            'commune_programmes': RotatingDataset('commune_programmes', COMMUNE_PROGRAMME_SCHEMA, self.writer_cls, self.output_dir, self.run_id, self.rotate_rows, self.rotate_seconds),
+            'refreshed': RotatingDataset('refreshed', REFRESHED_SCHEMA, self.writer_cls, self.output_dir, self.run_id, self.rotate_rows, self.rotate_seconds),
+        }
+        # Toutes les écritures disque passent par ce thread, jamais par celui du reactor
+        self.background = BackgroundWriter(name='subsidies-pipeline', max_pending=self.max_pending_batches)
+
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        if 'subsidy' not in adapter:
+            # Autres items (paragraphes, ...) : inchangés
+            return item
+        start = time.perf_counter()
+        item = self.intern(normalize_subsidy(adapter.asdict()))
+        self.buffers['commune_programmes'].append({field: item[field] for field in COMMUNE_PROGRAMME_FIELDS})
+        self.record('pipeline_process', time.perf_counter() - start)
+        pending = [self.flush(name) for name, rows in self.buffers.items() if len(rows) >= self.batch_size]
+        if pending and self.background.saturated:
+            # Contre-pression : l'item attend que son lot soit écrit
+            return defer.DeferredList(pending).addCallback(lambda _: item)
+        return item
+
+    def intern(self, item):
+        programme = self.programmes.get(item['programme_id'])
+        if programme is None:
+            programme = {field: item[field] for field in PROGRAMME_FIELDS}
+            self.programmes[item['programme_id']] = programme
+            self.buffers['programmes'].append(programme)
+            if self.stats is not None:
+                self.stats.inc_value('subsidies/programmes_unique')
+        else:
+            # Programme déjà connu : l'item réutilise les chaînes déjà en mémoire
+            for field in PROGRAMME_FIELDS:
+                item[field] = programme[field]
+            if self.stats is not None:
+                self.stats.inc_value('subsidies/programmes_shared')
         return item
+
+    def flush(self, name):
+        rows, self.buffers[name] = self.buffers[name], []
+        if not rows:
+            return defer.succeed(None)
+        d = self.background.submit(self.write_batch, name, rows)
+        d.addCallback(self.rows_written, name)
+        d.addErrback(self.write_failed, name, rows)
+        return d
+
+    def write_batch(self, name, rows):
+        # Exécuté dans le thread d'écriture
+        start = time.perf_counter()
+        count = self.datasets[name].write(rows)
+        return count, time.perf_counter() - start
+
+    def rows_written(self, result, name):
+        count, seconds = result
+        self.record('pipeline_write', seconds)
+        if self.stats is not None:
+            self.stats.inc_value(f'subsidies/{name}/rows_written', count)
+            self.stats.inc_value(f'subsidies/{name}/batches_written')
+
+    def record(self, stage, seconds):
+        # Voir subsidiesCrawler.extensions.CrawlInstrumentation
+        instrumentation = getattr(self.spider, 'instrumentation', None)
+        if instrumentation is not None:
+            instrumentation.record(stage, seconds)
+
+    def write_failed(self, failure, name, rows):
+        log_failure(failure, f"Échec de l'écriture d'un lot de {len(rows)} lignes ({name})")
+        # Le spider n'enregistre alors pas les empreintes du crawl incrémental
+        self.spider.output_failed = True
+        if self.stats is not None:
+            self.stats.inc_value(f'subsidies/{name}/batches_failed')
+
+    def close_failed(self, failure, message):
+        log_failure(failure, message)
+        self.spider.output_failed = True
+
+    def close_datasets(self):
+        for dataset in self.datasets.values():
+            dataset.close()
+
+    def close_spider(self, spider):
+        for name in self.buffers:
+            self.flush(name)
+        refreshed = [
+            {'commune_name': page['commune_name'], 'postal_code': str(page['postal_code']), 'profile': page['profile'], 'categories': list(page['categories'])}
+            for page in getattr(spider, 'refreshed', ())
+        ]
+        if refreshed:
+            d = self.background.submit(self.write_batch, 'refreshed', refreshed)
+            d.addCallback(self.rows_written, 'refreshed')
+            d.addErrback(self.write_failed, 'refreshed', refreshed)
+        d = self.background.submit(self.close_datasets)
+        d.addErrback(self.close_failed, "Échec de la fermeture des fichiers de sortie")
+        if self.index_path:
+            d.addCallback(lambda _: self.background.submit(self.update_index, getattr(spider, 'refreshed', ())))
+            d.addCallback(self.index_updated)
+            d.addErrback(self.close_failed, f"Échec de la mise à jour de l'index {self.index_path}")
+        d.addBoth(lambda _: self.background.close())
+        d.addCallback(self.closed)
+        return d
+
+    def update_index(self, refreshed):
+        # Exécuté dans le thread d'écriture, une fois tous les fichiers fermés
+        index = SubsidyIndex(self.index_path)
+        changes = None
+        if self.changes_dir:
+            # Différences avec l'état précédent de l'index, calculées pendant sa mise à jour
+            changes = ChangeFeed(os.path.join(self.changes_dir, f"changes-{self.run_id}.jsonl"), index.programme)
+        try:
+            communes = index.update(self.datasets['programmes'].files, self.datasets['commune_programmes'].files, refreshed, changes)
+        finally:
+            index.close()
+        return communes, dict(changes.counts) if changes is not None else {}
+
+    def index_updated(self, result):
+        communes, changes = result
+        if self.stats is not None:
+            self.stats.set_value('subsidies/index/communes_updated', communes)
+            for event, count in changes.items():
+                self.stats.set_value(f'subsidies/changes/{event}', count)
+
+    def closed(self, _):
+        if self.stats is not None:
+            for name, dataset in self.datasets.items():
+                self.stats.set_value(f'subsidies/{name}/files_written', len(dataset.files))
@@ -0,0 +1,96 @@
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveCacheStorage:
+    """HTTP cache storage keeping every response in one compressed archive.
+
+    Responses are stored zlib-compressed in a single SQLite file per
+    spider (HTTPCACHE_DIR/<spider>.sqlite) keyed by request fingerprint,
+    which makes an archive easy to copy between machines or CI runs.
+
+    Record (fetches missing pages and archives them)::
+
+        scrapy crawl francsenergie_spider -s HTTPCACHE_ENABLED=1
+
+    Replay (serves only archived pages, no network)::
+
+        scrapy crawl francsenergie_spider -s HTTPCACHE_ENABLED=1 -s HTTPCACHE_IGNORE_MISSING=1
+    """
+
+    commit_every = 100
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.conn = None
+        self._pending = 0
+
+    def open_spider(self, spider):
+        self.path = os.path.join(self.cachedir, f"{spider.name}.sqlite")
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " status INTEGER NOT NULL,"
+            " headers BLOB NOT NULL,"
+            " body BLOB NOT NULL,"
+            " timestamp REAL NOT NULL)"
+        )
+        self.conn.commit()
+        logger.debug("Using archive cache storage in %(path)s", {'path': self.path}, extra={'spider': spider})
+
+    def close_spider(self, spider):
+        self.conn.commit()
+        self.conn.close()
+
+    def retrieve_response(self, spider, request):
+        row = self.conn.execute(
+            "SELECT url, status, headers, body, timestamp FROM responses WHERE fingerprint = ?",
+            (self._fingerprinter.fingerprint(request).hex(),),
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, timestamp = row
+        if 0 < self.expiration_secs < time.time() - timestamp:
+            return None
+        headers = Headers(headers_raw_to_dict(zlib.decompress(headers)))
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        if response.status == 304:
+            # Réponse à une requête conditionnelle : rien à rejouer
+            return
+        if response.status == 429 or response.status >= 500:
+            # Erreur passagère : archivée, elle serait resservie à chaque nouvelle tentative
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (fingerprint, url, status, headers, body, timestamp)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self._fingerprinter.fingerprint(request).hex(),
+                response.url,
+                response.status,
+                zlib.compress(headers_dict_to_raw(response.headers)),
+                zlib.compress(response.body),
+                time.time(),
+            ),
+        )
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.conn.commit()
+            self._pending = 0
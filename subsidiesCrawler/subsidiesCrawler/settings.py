@@ -11,6 +11,7 @@ BOT_NAME = "subsidiesCrawler"
 
 SPIDER_MODULES = ["subsidiesCrawler.spiders"]
 NEWSPIDER_MODULE = "subsidiesCrawler.spiders"
+COMMANDS_MODULE = "subsidiesCrawler.commands"
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -20,14 +21,14 @@ NEWSPIDER_MODULE = "subsidiesCrawler.spiders"
 ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+CONCURRENT_REQUESTS = 32
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
 #DOWNLOAD_DELAY = 3
 # The download delay setting will honor only one of:
-#CONCURRENT_REQUESTS_PER_DOMAIN = 16
+CONCURRENT_REQUESTS_PER_DOMAIN = 16
 #CONCURRENT_REQUESTS_PER_IP = 16
 
 # Disable cookies (enabled by default)
@@ -50,21 +51,50 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "subsidiesCrawler.middlewares.SubsidiescrawlerDownloaderMiddleware": 543,
-#}
+# AdaptiveThrottleMiddleware must come after RetryMiddleware (550) to see
+# the 429/5xx responses before they are retried
+DOWNLOADER_MIDDLEWARES = {
+    "subsidiesCrawler.middlewares.AdaptiveThrottleMiddleware": 560,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "subsidiesCrawler.extensions.CrawlInstrumentation": 500,
+}
+
+# Per-stage timings (download, paragraphs, parse, filter, pipeline_process,
+# pipeline_write) and per-commune outcomes, exported to the crawl stats and
+# to the files below at close. INSTRUMENTATION_PROFILE dumps a cProfile of
+# the reactor thread to INSTRUMENTATION_PROFILE_PATH.
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_JSON_PATH = "crawl_metrics.json"
+INSTRUMENTATION_PROMETHEUS_PATH = "crawl_metrics.prom"
+INSTRUMENTATION_TOP_N = 20
+INSTRUMENTATION_PROFILE = False
+INSTRUMENTATION_PROFILE_PATH = "crawl.prof"
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "subsidiesCrawler.pipelines.SubsidiescrawlerPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "subsidiesCrawler.pipelines.SubsidiescrawlerPipeline": 300,
+}
+
+# Subsidies output: batched Parquet ("parquet") or append-only JSON lines ("jsonl"),
+# rotated to a new file after SUBSIDIES_ROTATE_ROWS rows or SUBSIDIES_ROTATE_SECONDS
+SUBSIDIES_OUTPUT_DIR = "subsidies_data"
+SUBSIDIES_OUTPUT_FORMAT = "parquet"
+SUBSIDIES_BATCH_SIZE = 500
+SUBSIDIES_ROTATE_ROWS = 100000
+SUBSIDIES_ROTATE_SECONDS = 3600
+# Batches queued for the background writer thread before items wait (backpressure)
+SUBSIDIES_MAX_PENDING_BATCHES = 8
+# SQLite index updated at the end of each crawl (None to disable), queried
+# with `scrapy subsidies query ...` or subsidiesCrawler.index.SubsidyIndex
+SUBSIDIES_INDEX_PATH = "subsidies_index.sqlite"
+# Change feed (JSON lines, one changes-<run>.jsonl per crawl) of the subsidies
+# added, modified or removed since the previous state of the index (None to disable)
+SUBSIDIES_CHANGES_DIR = "subsidies_changes"
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -79,15 +109,79 @@ ROBOTSTXT_OBEY = True
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = False
 
+# Adaptive per-domain concurrency and delay (replaces AutoThrottle, keep it disabled).
+# Concurrency moves between 1 and ADAPTIVE_THROTTLE_MAX_CONCURRENCY, the delay
+# between ADAPTIVE_THROTTLE_MIN_DELAY and ADAPTIVE_THROTTLE_MAX_DELAY, from a
+# rolling window of the last ADAPTIVE_THROTTLE_WINDOW responses.
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_WINDOW = 50
+ADAPTIVE_THROTTLE_TARGET_LATENCY = 1.0
+ADAPTIVE_THROTTLE_MAX_ERROR_RATE = 0.05
+ADAPTIVE_THROTTLE_START_DELAY = 0.5
+ADAPTIVE_THROTTLE_MIN_DELAY = 0.0
+ADAPTIVE_THROTTLE_MAX_DELAY = 60.0
+ADAPTIVE_THROTTLE_BACKOFF_BASE = 1.0
+ADAPTIVE_THROTTLE_START_CONCURRENCY = 2
+ADAPTIVE_THROTTLE_MAX_CONCURRENCY = 16
+ADAPTIVE_THROTTLE_ERROR_CODES = [429, 500, 502, 503, 504]
+
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+# The cache doubles as the offline replay archive (see subsidiesCrawler.replay):
+# record with -s HTTPCACHE_ENABLED=1, replay without network with
+# -s HTTPCACHE_ENABLED=1 -s HTTPCACHE_IGNORE_MISSING=1
 #HTTPCACHE_ENABLED = True
 #HTTPCACHE_EXPIRATION_SECS = 0
 #HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# Transient errors are never archived, so that retries reach the site
+HTTPCACHE_IGNORE_HTTP_CODES = [429, 500, 502, 503, 504]
+HTTPCACHE_STORAGE = "subsidiesCrawler.replay.ArchiveCacheStorage"
+HTTPCACHE_POLICY = "scrapy.extensions.httpcache.DummyPolicy"
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
+
+# Incremental recrawl: conditional requests and per-commune fingerprints
+# Enable with INCREMENTAL_CRAWL = True or `scrapy crawl francsenergie_spider -a incremental=1`
+INCREMENTAL_CRAWL = False
+FINGERPRINT_STORE_PATH = "fingerprints.sqlite"
+INCREMENTAL_REPORT_PATH = "incremental_report.json"
+
+# Also yield one item per <p> text of each page (or `-a paragraphs=1`)
+EXTRACT_PARAGRAPHS = False
+
+# Field categories and contributor rules applied to each commune page.
+# Host entries match the host and all its subdomains. Set
+# SUBSIDIES_FILTER_RULES_FILE to load the same structure from JSON/YAML.
+SUBSIDIES_FILTER_RULES = {
+    "categories": {
+        "electricity": {
+            "fields": ["Production d’électricité"],
+            "exclude": {
+                "pronovo": ["pronovo.ch"],
+                "canton-vd": ["vd.ch"],
+                "infrawatt": ["infrawatt.ch"],
+            },
+        },
+    },
+}
+SUBSIDIES_FILTER_RULES_FILE = None
+
+# Commune lists (JSON arrays of {"postalCode", "name", "canton"}) and the
+# francsenergie.ch profiles crawled for each commune; see the spider for
+# the -a communes/cantons/profiles/categories/shard arguments.
+COMMUNES_SOURCES = ["vaud_communes.json"]
+# Canton of the lists that have no "canton" key, by file name; communes
+# without canton in any other list are an error
+COMMUNES_DEFAULT_CANTONS = {"vaud_communes.json": "VD"}
+CRAWL_PROFILES = ["building/personal"]
+
+# Communes without JSON or without any selected subsidy are appended to this
+# file, written off the reactor thread (None to disable)
+DIAGNOSTICS_LOG_FILE = "logs.txt"
+
+# Resumable crawls (-s JOBDIR=crawls/run-1): compact FIFO request queues on disk
+SCHEDULER_DISK_QUEUE = "scrapy.squeues.MarshalFifoDiskQueue"
+SCHEDULER_MEMORY_QUEUE = "scrapy.squeues.FifoMemoryQueue"
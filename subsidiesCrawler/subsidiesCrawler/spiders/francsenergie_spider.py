@@ -1,77 +1,301 @@
 import scrapy
 import json
 import os
+import time
+import zlib
+from contextlib import contextmanager
+
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from subsidiesCrawler.background import BackgroundWriter, log_failure
+from subsidiesCrawler.extractors import extract_subsidies_props, loads
+from subsidiesCrawler.filters import SubsidyFilter
+from subsidiesCrawler.fingerprints import FingerprintStore, content_hash
 
 class MySpider(scrapy.Spider):
     name = "francsenergie_spider"
-    log_file_path = '/Users/saddamsatouyev/SubsidiesCrawler/subsidiesCrawler/logs.txt'
+    # Renseigné par l'extension CrawlInstrumentation quand elle est active
+    instrumentation = None
+    # Mis à True par SubsidiescrawlerPipeline si un lot ou l'index n'a pas pu être écrit
+    output_failed = False
+
+    # Arguments (-a), tous optionnels :
+    #   communes=a.json,b.json   listes de communes (COMMUNES_SOURCES)
+    #   cantons=VD,GE            ne garder que ces cantons
+    #   profiles=building/personal,building/company   (CRAWL_PROFILES)
+    #   categories=electricity,heating   catégories de SUBSIDIES_FILTER_RULES
+    #   shard=0/4 shard_by=hash|canton   ne traiter qu'une tranche des communes
+    # Avec -s JOBDIR=..., un crawl interrompu reprend là où il s'était arrêté.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard_index, self.shard_count = self.parse_shard(getattr(self, 'shard', None))
+        # Utilisé aussi par le pipeline pour nommer les fichiers de sortie
+        self.shard_label = f"shard{self.shard_index}of{self.shard_count}" if self.shard_count > 1 else None
 
     def start_requests(self):
-        # Charger le fichier JSON contenant les communes
-        with open('/Users/saddamsatouyev/SubsidiesCrawler/subsidiesCrawler/vaud_communes.json', 'r', encoding='utf-8') as f:
-            communes = json.load(f)
-        
+        # Mode incrémental : -a incremental=1 ou INCREMENTAL_CRAWL = True
+        self.incremental = self.flag('incremental', 'INCREMENTAL_CRAWL')
+        # Export des paragraphes : -a paragraphs=1 ou EXTRACT_PARAGRAPHS = True
+        self.paragraphs = self.flag('paragraphs', 'EXTRACT_PARAGRAPHS')
+        # Règles de sélection des champs et des contributeurs, compilées une seule fois
+        self.filter = SubsidyFilter.from_settings(self.settings, categories=self.list_argument('categories', None))
+        self.store = None
+        # Empreintes des pages parsées, enregistrées seulement une fois leurs items écrits (voir closed)
+        self.pending = {}
+        # Avec JOBDIR, self.state est sauvegardé entre deux reprises du même crawl
+        self.changes = getattr(self, 'state', {}).setdefault('changes', {'added': [], 'changed': [], 'unchanged': [], 'removed': []})
+        # Pages (re)lues pendant ce processus : leurs liens sont remplacés dans l'index en fin de crawl
+        self.refreshed = []
+        # Diagnostics et empreintes sont écrits hors du thread du reactor
+        self.background = BackgroundWriter(name='francsenergie-diagnostics')
+        self.log_file = None
+        self.log_file_path = self.settings.get('DIAGNOSTICS_LOG_FILE')
+        if self.incremental:
+            self.store = FingerprintStore(self.settings.get('FINGERPRINT_STORE_PATH'), writer=self.background)
+            self.log(f"Mode incrémental : {len(self.store)} empreintes chargées depuis {self.store.path}")
+
+        profiles = self.list_argument('profiles', 'CRAWL_PROFILES')
+        if self.shard_label:
+            self.log(f"Tranche {self.shard_index + 1}/{self.shard_count} (répartition par {getattr(self, 'shard_by', 'hash')})")
+
         # Construire les URLs dynamiques avec le code postal et le nom de la commune
-        for commune in communes:
+        for commune in self.load_communes():
             postal_code = commune['postalCode']
             commune_name = commune['name'].replace(" ", "-")  # Remplacer les espaces par des tirets
-            url = f"https://www.francsenergie.ch/fr/{postal_code}-{commune_name}/building/personal"
-            yield scrapy.Request(url=url, callback=self.parse, meta={'commune_name': commune['name'], 'postal_code': postal_code})
+            for profile in profiles:
+                url = f"https://www.francsenergie.ch/fr/{postal_code}-{commune_name}/{profile}"
+                meta = {'commune_name': commune['name'], 'postal_code': postal_code, 'canton': commune['canton'], 'profile': profile}
+                headers = {}
+                if self.store is not None:
+                    # Requête conditionnelle : 304 si la page n'a pas changé, 404/410 si elle a disparu
+                    headers = self.store.conditional_headers(self.fingerprint_key(meta))
+                    meta['handle_httpstatus_list'] = [304, 404, 410]
+                yield scrapy.Request(url=url, callback=self.parse, headers=headers, meta=meta)
+
+    def load_communes(self):
+        # Charger les fichiers JSON contenant les communes, filtrés par canton et par tranche
+        cantons = {canton.upper() for canton in self.list_argument('cantons', None)}
+        default_cantons = self.settings.getdict('COMMUNES_DEFAULT_CANTONS')
+        for source in self.list_argument('communes', 'COMMUNES_SOURCES'):
+            with open(source, 'r', encoding='utf-8') as f:
+                communes = json.load(f)
+            # Seules les listes déclarées dans COMMUNES_DEFAULT_CANTONS peuvent omettre le canton
+            default_canton = default_cantons.get(os.path.basename(source))
+            for commune in communes:
+                canton = commune.get('canton') or default_canton
+                if not canton:
+                    raise ValueError(f"{source} : canton manquant pour {commune.get('name')} ({commune.get('postalCode')})")
+                commune['canton'] = canton.upper()
+                if cantons and commune['canton'] not in cantons:
+                    continue
+                if self.shard_count > 1 and self.shard_of(commune) != self.shard_index:
+                    continue
+                yield commune
+
+    def list_argument(self, argument, setting):
+        # Argument -a séparé par des virgules, sinon liste du setting
+        value = getattr(self, argument, None)
+        if value is None:
+            return self.settings.getlist(setting) if setting else []
+        return [part.strip() for part in value.split(',') if part.strip()]
+
+    @staticmethod
+    def parse_shard(shard):
+        if not shard:
+            return 0, 1
+        index, _, count = shard.partition('/')
+        index, count = int(index), int(count)
+        if not 0 <= index < count:
+            raise ValueError(f"shard={shard!r} : attendu i/n avec 0 <= i < n")
+        return index, count
 
-    def parse(self, response):
+    def shard_of(self, commune):
+        # crc32 plutôt que hash() : stable d'un processus et d'une machine à l'autre
+        shard_by = getattr(self, 'shard_by', 'hash')
+        if shard_by == 'canton':
+            key = commune['canton']
+        elif shard_by == 'hash':
+            key = f"{commune['postalCode']}-{commune['name']}"
+        else:
+            raise ValueError(f"shard_by={shard_by!r} : attendu 'hash' ou 'canton'")
+        return zlib.crc32(key.encode('utf-8')) % self.shard_count
+
+    def flag(self, argument, setting):
+        # Les arguments -a arrivent sous forme de chaînes
+        return str(getattr(self, argument, self.settings.getbool(setting))).lower() in ('1', 'true', 'yes')
+
+    def fingerprint_key(self, meta):
+        return FingerprintStore.key(meta['postal_code'], meta['commune_name'], meta['profile'])
+
+    async def parse(self, response):
         commune_name = response.meta['commune_name']
         postal_code = response.meta['postal_code']
+        # Contre-pression : la page suivante attend que le thread d'écriture ait rattrapé son retard
+        if self.background.saturated:
+            await maybe_deferred_to_future(self.background.ready())
 
-        # Extraction des paragraphes (exemple)
-        for paragraph in response.css('p::text').getall():
-            yield {"paragraphe": paragraph}
-
-        # Sélection du div contenant le JSON
-        div = response.css('div[data-svelte-component="subsidies"]::attr(data-svelte-props)').get()
-        
-        if div:
-            # Chargement du JSON
-            json_data = json.loads(div)
-            
-            # Filtrer les champs pour ne garder que ceux avec 'name' == 'Production d'électricité'
-            filtered_fields =  [field for field in json_data['town']['fields'] if field['name'] == 'Production d’électricité']
-            if filtered_fields:
-                subsidies = filtered_fields[0]['subsidies']
-            else:
-                subsidies = []
-            # Filtrer les subventions pour ignorer certaines URLs
-            filtered_partners_subsidies = [
-                filtered_field for filtered_field in subsidies 
-                if not (
-                    filtered_field['contributor']['url'].startswith('https://pronovo.ch') or
-                    filtered_field['contributor']['url'].startswith('http://pronovo.ch') or
-                    filtered_field['contributor']['url'].startswith('https://www.vd.ch') or
-                    filtered_field['contributor']['url'].startswith('http://www.vd.ch') or
-                    filtered_field['contributor']['url'].startswith('https://www.infrawatt.ch') or
-                    filtered_field['contributor']['url'].startswith('http://www.infrawatt.ch')
-                )
-            ]
-            
-            # Mettre à jour les champs avec les champs filtrés
-            json_data['town']['fields'] = filtered_partners_subsidies
-            
-            # Vérifier si 'fields' est vide avant de sauvegarder
-            if json_data['town']['fields']:
-                # Chemin du fichier de sortie
-                output_file = os.path.join('/Users/saddamsatouyev/SubsidiesCrawler/subsidiesCrawler/subsidies_data', f"{commune_name}_{postal_code}.json")
-                
-                # Sauvegarde du JSON dans un fichier
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(json_data, f, ensure_ascii=False, indent=4)
-                
-                self.log(f"JSON sauvegardé dans {output_file}")
-            else:
-                self.log(f"Aucun champ valide pour {commune_name} ({postal_code}), fichier non sauvegardé.")
-                self.log_to_file(f"Aucun champ valide pour {commune_name} ({postal_code}), fichier non sauvegardé.")
-        else:
+        if self.store is not None:
+            if response.status == 304:
+                self.record_change('unchanged', response.meta)
+                self.outcome('unchanged', response.meta)
+                return
+            if response.status in (404, 410):
+                self.forget(response.meta)
+                self.refresh(response.meta)
+                return
+
+        # Extraction des paragraphes (optionnelle)
+        if self.paragraphs:
+            with self.timed('paragraphs', response.meta):
+                paragraphs = response.css('p::text').getall()
+            for paragraph in paragraphs:
+                yield {"paragraphe": paragraph}
+
+        with self.timed('parse', response.meta):
+            # Lecture directe de l'attribut data-svelte-props du div, sans parser tout le HTML
+            div = extract_subsidies_props(response.body, response.encoding)
+            json_data = None
+            fingerprint = None
+            # En mode incrémental, un contenu identique au dernier passage n'est ni parsé ni réécrit
+            if div and self.store is not None:
+                fingerprint = self.fingerprint(response, div)
+            if div and (self.store is None or fingerprint is not None):
+                # Chargement du JSON
+                json_data = loads(div)
+
+        if not div:
+            if self.store is not None:
+                self.forget(response.meta)
+            self.refresh(response.meta)
+            self.outcome('no_json', response.meta)
             self.log("Aucun JSON trouvé dans le div spécifié.")
             self.log_to_file(f"Aucun JSON trouvé pour {commune_name} ({postal_code}).")
+            return
+        if json_data is None:
+            self.outcome('unchanged', response.meta)
+            return
+
+        with self.timed('filter', response.meta):
+            selected = list(self.filter.select(json_data['town']['fields']))
+
+        # Une subvention par item, normalisée et écrite par lots dans SubsidiescrawlerPipeline
+        for category, field_name, subsidy in selected:
+            yield {
+                'commune_name': commune_name,
+                'postal_code': postal_code,
+                'canton': response.meta['canton'],
+                'profile': response.meta['profile'],
+                'category': category,
+                'field': field_name,
+                'subsidy': subsidy,
+            }
+
+        self.refresh(response.meta)
+        if fingerprint is not None:
+            self.remember(response.meta, *fingerprint)
+        if selected:
+            self.outcome('saved', response.meta)
+        else:
+            self.outcome('empty', response.meta)
+            self.log(f"Aucun champ valide pour {commune_name} ({postal_code}), rien à sauvegarder.")
+            self.log_to_file(f"Aucun champ valide pour {commune_name} ({postal_code}), rien à sauvegarder.")
+
+    @contextmanager
+    def timed(self, stage, meta):
+        # Durée d'une étape, transmise à CrawlInstrumentation
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.instrumentation is not None:
+                self.instrumentation.record(stage, time.perf_counter() - start, meta)
+
+    def outcome(self, name, meta):
+        if self.instrumentation is not None:
+            self.instrumentation.outcome(name, meta)
+
+    def fingerprint(self, response, div):
+        # Empreinte de la page, ou None si le contenu n'a pas changé depuis le dernier passage
+        key = self.fingerprint_key(response.meta)
+        previous = self.store.get(key)
+        digest = content_hash(div, self.filter.digest)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        entry = (
+            etag.decode('latin-1') if etag else None,
+            last_modified.decode('latin-1') if last_modified else None,
+            digest,
+        )
+        if previous is not None and previous[2] == digest:
+            # Même contenu : seuls les validateurs HTTP sont rafraîchis
+            self.store.update(key, *entry)
+            self.record_change('unchanged', response.meta)
+            return None
+        return ('added' if previous is None else 'changed', entry)
+
+    def remember(self, meta, change, entry):
+        # Page parsée sans erreur : son empreinte sera enregistrée à la fermeture si la sortie a été écrite
+        self.pending[self.fingerprint_key(meta)] = entry
+        self.record_change(change, meta)
+
+    def forget(self, meta):
+        key = self.fingerprint_key(meta)
+        if key in self.store:
+            self.store.delete(key)
+            self.record_change('removed', meta)
+
+    def refresh(self, meta):
+        # Les liens de ces catégories seront remplacés dans l'index, pas ceux des autres
+        page = {key: meta[key] for key in ('commune_name', 'postal_code', 'profile')}
+        page['categories'] = self.filter.categories
+        self.refreshed.append(page)
+
+    def record_change(self, change, meta):
+        self.changes[change].append({key: meta[key] for key in ('commune_name', 'postal_code', 'canton', 'profile')})
+        self.crawler.stats.inc_value(f'incremental/{change}')
+
+    def closed(self, reason):
+        background = getattr(self, 'background', None)
+        if background is None:
+            return
+        self.filter.export_stats(self.crawler.stats)
+        if self.store is not None:
+            if self.output_failed:
+                # Sans empreinte, ces pages seront relues au prochain crawl
+                self.logger.warning(f"Sortie incomplète : {len(self.pending)} empreinte(s) non enregistrée(s)")
+            else:
+                for key, entry in self.pending.items():
+                    self.store.update(key, *entry)
+            self.store.close()
+            counts = {change: len(communes) for change, communes in self.changes.items()}
+            self.log(f"Crawl incrémental terminé : {counts}")
+            report_path = self.settings.get('INCREMENTAL_REPORT_PATH')
+            if report_path:
+                self.persist(self.write_report, report_path, {'reason': reason, 'counts': counts, **self.changes})
+        self.persist(self.close_log_file)
+        return background.close()
+
+    def persist(self, fn, *args):
+        d = self.background.submit(fn, *args)
+        d.addErrback(log_failure, f"Échec de l'écriture en arrière-plan ({fn.__name__})")
+        return d
+
+    def write_report(self, report_path, report):
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
 
     def log_to_file(self, message):
-        with open(self.log_file_path, 'a', encoding='utf-8') as log_file:
-            log_file.write(message + '\n')
\ No newline at end of file
+        if self.log_file_path:
+            self.persist(self.append_log, message)
+
+    def append_log(self, message):
+        # Exécuté dans le thread d'écriture : le fichier reste ouvert jusqu'à la fermeture
+        if self.log_file is None:
+            self.log_file = open(self.log_file_path, 'a', encoding='utf-8')
+        self.log_file.write(message + '\n')
+
+    def close_log_file(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
@@ -0,0 +1,71 @@
+import glob
+import json
+import os
+
+import pytest
+from parsel import Selector
+
+from subsidiesCrawler.extractors import SUBSIDIES_CSS, extract_subsidies_props, loads
+
+
+SAMPLES = os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks', 'samples')
+
+
+def page(div):
+    return f'<html><body><p>x</p>{div}</body></html>'.encode('utf-8')
+
+
+def test_double_quoted_marker():
+    body = page('<div class="s" data-svelte-component="subsidies" data-svelte-props="{&quot;a&quot;: 1}"></div>')
+    assert extract_subsidies_props(body) == '{"a": 1}'
+
+
+def test_props_before_marker():
+    body = page('<div data-svelte-props="{&quot;a&quot;: 1}" data-svelte-component="subsidies"></div>')
+    assert extract_subsidies_props(body) == '{"a": 1}'
+
+
+def test_other_attribute_containing_closing_bracket():
+    body = page('<div title="a > b" data-svelte-component="subsidies" data-svelte-props="[1]"></div>')
+    assert extract_subsidies_props(body) == '[1]'
+
+
+@pytest.mark.parametrize('div', [
+    "<div data-svelte-component='subsidies' data-svelte-props='{\"a\": 1}'></div>",
+    '<div data-svelte-component = "subsidies" data-svelte-props="{&quot;a&quot;: 1}"></div>',
+])
+def test_marker_variants_fall_back_to_parsel(div):
+    assert extract_subsidies_props(page(div)) == '{"a": 1}'
+
+
+@pytest.mark.parametrize('escaped, expected', [
+    ('&quot;a &amp;quot; b&quot;', '"a &quot; b"'),
+    ('&quot;&eacute;t&#233;&quot;', '"été"'),
+    ('&quot;&lt;b&gt; l&#39;eau &amp; l&#x27;air&quot;', '"<b> l\'eau & l\'air"'),
+    ('&quot;sans point-virgule &quot', '"sans point-virgule "'),
+])
+def test_entities(escaped, expected):
+    body = page(f'<div data-svelte-component="subsidies" data-svelte-props="{escaped}"></div>')
+    assert extract_subsidies_props(body) == expected
+
+
+def test_non_utf8_encoding():
+    body = '<div data-svelte-component="subsidies" data-svelte-props="&quot;é&quot;"></div>'.encode('latin-1')
+    assert extract_subsidies_props(body, 'latin-1') == '"é"'
+
+
+@pytest.mark.parametrize('div', ['', '<div data-svelte-component="header" data-svelte-props="{}"></div>'])
+def test_no_subsidies_component(div):
+    assert extract_subsidies_props(page(div)) is None
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(SAMPLES, '*.html'))))
+def test_same_result_as_parsel_on_samples(path):
+    with open(path, 'rb') as f:
+        body = f.read()
+    expected = Selector(text=body.decode('utf-8')).css(SUBSIDIES_CSS).get()
+    assert extract_subsidies_props(body) == expected
+
+
+def test_loads():
+    assert loads('{"town": {"fields": []}}') == json.loads('{"town": {"fields": []}}')
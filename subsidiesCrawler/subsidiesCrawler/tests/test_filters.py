@@ -0,0 +1,97 @@
+import json
+
+import pytest
+from scrapy.settings import Settings
+
+from subsidiesCrawler.filters import HostRules, SubsidyFilter, normalize_name
+
+
+RULES = {
+    "exclude": {"spam": ["spam.example"]},
+    "categories": {
+        "electricity": {
+            "fields": ["Production d’électricité"],
+            "exclude": {"pronovo": ["pronovo.ch"]},
+        },
+        "heating": {
+            "fields": ["Chauffage"],
+            "include": {"canton": ["vd.ch"]},
+        },
+    },
+}
+
+
+def subsidy(url, name='S'):
+    return {'name': name, 'contributor': {'name': 'C', 'url': url}}
+
+
+def test_normalize_name():
+    assert normalize_name("  Production  D'ÉLECTRICITÉ ") == normalize_name("Production d’électricité")
+    assert normalize_name("Chauffage") != normalize_name("Chauffages")
+
+
+@pytest.mark.parametrize('host, expected', [
+    ('pronovo.ch', 'pronovo'),
+    ('www.pronovo.ch', 'pronovo'),
+    ('a.b.pronovo.ch', 'pronovo'),
+    ('notpronovo.ch', None),
+    ('pronovo.ch.example', None),
+    ('ch', None),
+    (None, None),
+])
+def test_host_rules_suffixes(host, expected):
+    assert HostRules({'pronovo': ['pronovo.ch', '.Pronovo.CH.']}).match(host) == expected
+
+
+def test_select_by_field_and_contributor():
+    selector = SubsidyFilter(RULES)
+    fields = [
+        {'name': "PRODUCTION D'ELECTRICITE", 'subsidies': [
+            subsidy('https://www.commune.ch/a', 'kept'),
+            subsidy('https://www.pronovo.ch/x', 'pronovo'),
+            subsidy('https://spam.example/', 'global exclude'),
+            {'name': 'no contributor'},
+        ]},
+        {'name': 'Chauffage', 'subsidies': [
+            subsidy('https://www.vd.ch/energie', 'included'),
+            subsidy('https://www.ge.ch/', 'not included'),
+        ]},
+        {'name': 'Isolation', 'subsidies': [subsidy('https://www.commune.ch/')]},
+    ]
+    selected = [(category, subsidy['name']) for category, _, subsidy in selector.select(fields)]
+    assert selected == [('electricity', 'kept'), ('electricity', 'no contributor'), ('heating', 'included')]
+    assert selector.hits['electricity/exclude/pronovo'] == 1
+    assert selector.hits['electricity/exclude/spam'] == 1
+    assert selector.hits['heating/not_included'] == 1
+    assert selector.hits['heating/include/canton'] == 1
+
+
+def test_malformed_contributor_url():
+    selector = SubsidyFilter(RULES)
+    fields = [
+        {'name': 'Production d’électricité', 'subsidies': [subsidy('https://[::1/', 'malformed')]},
+        {'name': 'Chauffage', 'subsidies': [subsidy('https://[::1/', 'malformed')]},
+    ]
+    # Sans hôte : gardée faute d'exclusion, écartée là où un include est requis
+    assert [(category, subsidy['name']) for category, _, subsidy in selector.select(fields)] == [('electricity', 'malformed')]
+    assert selector.hits['heating/not_included'] == 1
+
+
+def test_categories_restriction():
+    selector = SubsidyFilter(RULES, categories=['heating'])
+    assert selector.categories == ['heating']
+    assert selector.category('Production d’électricité') is None
+    assert selector.digest != SubsidyFilter(RULES).digest
+
+
+def test_unknown_category():
+    with pytest.raises(ValueError):
+        SubsidyFilter(RULES, categories=['water'])
+
+
+def test_from_settings_rules_file(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(RULES), encoding='utf-8')
+    selector = SubsidyFilter.from_settings(Settings({'SUBSIDIES_FILTER_RULES_FILE': str(path)}))
+    assert sorted(selector.categories) == ['electricity', 'heating']
+    assert selector.digest == SubsidyFilter(RULES).digest
@@ -0,0 +1,188 @@
+import json
+import sqlite3
+
+import pytest
+
+from subsidiesCrawler.changes import ChangeFeed, diff_values
+from subsidiesCrawler.index import SubsidyIndex, read_rows
+
+
+def programme(programme_id, title='PV', contributor='Commune X', amount=500):
+    return {
+        'programme_id': programme_id,
+        'contributor_name': contributor,
+        'contributor_url': f'https://www.{contributor.split()[-1].lower()}.ch/',
+        'title': title,
+        'amounts': json.dumps(amount),
+        'conditions': None,
+        'payload': json.dumps({'name': title, 'amount': amount}),
+    }
+
+
+def link(programme_id, category='electricity', postal_code='1003', commune_name='Lausanne'):
+    field = {'electricity': "Production d’électricité", 'heating': 'Chauffage'}[category]
+    return {
+        'commune_name': commune_name, 'postal_code': postal_code, 'canton': 'VD', 'profile': 'building/personal',
+        'category': category, 'field': field, 'programme_id': programme_id,
+    }
+
+
+def page(categories, postal_code='1003', commune_name='Lausanne'):
+    return {'commune_name': commune_name, 'postal_code': postal_code, 'profile': 'building/personal', 'categories': categories}
+
+
+class Crawl:
+    # Fichiers JSON lines d'un crawl, au format de SubsidiescrawlerPipeline
+    def __init__(self, directory, run_id):
+        self.directory = directory
+        self.run_id = run_id
+
+    def write(self, name, rows):
+        path = self.directory / f'{name}-{self.run_id}-0001.jsonl'
+        path.write_text(''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows), encoding='utf-8')
+        return [str(path)]
+
+    def apply(self, index, programmes, links, refreshed, changes=None):
+        self.write('refreshed', refreshed)
+        return index.update(self.write('programmes', programmes), self.write('commune_programmes', links), refreshed, changes)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SubsidyIndex(str(tmp_path / 'index.sqlite'))
+    yield index
+    index.close()
+
+
+def feed(tmp_path, index, name='changes.jsonl'):
+    return ChangeFeed(str(tmp_path / name), index.programme)
+
+
+def events(changes):
+    return [json.loads(line) for line in open(changes.path, encoding='utf-8')]
+
+
+def lookup(index, **filters):
+    return sorted((row['category'], row['programme_id']) for row in index.lookup(**filters))
+
+
+def test_update_and_lookup(tmp_path, index):
+    crawl = Crawl(tmp_path, '1')
+    communes = crawl.apply(
+        index, [programme('a'), programme('h', 'PAC', 'Canton VD')],
+        [link('a'), link('h', 'heating'), link('a', postal_code='1400', commune_name='Yverdon')],
+        [page(['electricity', 'heating']), page(['electricity', 'heating'], '1400', 'Yverdon')],
+    )
+    assert communes == 2
+    assert lookup(index, postal_code='1003') == [('electricity', 'a'), ('heating', 'h')]
+    assert lookup(index, contributor='Canton VD') == [('heating', 'h')]
+    assert [row['postal_code'] for row in index.communes_offering('a')] == ['1003', '1400']
+
+
+def test_category_restricted_crawl_keeps_other_categories(tmp_path, index):
+    Crawl(tmp_path, '1').apply(index, [programme('a'), programme('h', 'PAC')], [link('a'), link('h', 'heating')], [page(['electricity', 'heating'])])
+    changes = feed(tmp_path, index)
+    Crawl(tmp_path, '2').apply(index, [programme('h', 'PAC')], [link('h', 'heating')], [page(['heating'])], changes)
+    assert lookup(index, postal_code='1003') == [('electricity', 'a'), ('heating', 'h')]
+    assert changes.counts == {}
+
+
+def test_emptied_page_and_orphan_programmes(tmp_path, index):
+    Crawl(tmp_path, '1').apply(index, [programme('a')], [link('a')], [page(['electricity'])])
+    Crawl(tmp_path, '2').apply(index, [], [], [page(['electricity'])])
+    assert index.lookup(postal_code='1003') == []
+    assert index.conn.execute('SELECT COUNT(*) FROM programmes').fetchone()[0] == 0
+
+
+def test_rebuild_replays_refreshed_pages(tmp_path, index):
+    Crawl(tmp_path, '20250101T000000').apply(index, [programme('a')], [link('a'), link('a', postal_code='1400', commune_name='Yverdon')], [page(['electricity']), page(['electricity'], '1400', 'Yverdon')])
+    Crawl(tmp_path, '20250102T000000').apply(index, [], [], [page(['electricity'], '1400', 'Yverdon')])
+    rebuilt = SubsidyIndex(str(tmp_path / 'rebuilt.sqlite'))
+    try:
+        assert rebuilt.rebuild(str(tmp_path)) == 2
+        assert lookup(rebuilt, postal_code='1400') == []
+        assert lookup(rebuilt, postal_code='1003') == [('electricity', 'a')]
+    finally:
+        rebuilt.close()
+
+
+def test_change_feed_events(tmp_path, index):
+    first = feed(tmp_path, index, 'first.jsonl')
+    Crawl(tmp_path, '1').apply(index, [programme('a'), programme('b', 'RU', 'Pronovo')], [link('a'), link('b')], [page(['electricity'])], first)
+    assert first.counts == {'added': 2}
+
+    changes = feed(tmp_path, index)
+    Crawl(tmp_path, '2').apply(
+        index, [programme('a2', amount=750), programme('c', 'PAC', 'Canton VD')], [link('a2'), link('c')], [page(['electricity'])], changes,
+    )
+    by_event = {event['event']: event for event in events(changes)}
+    assert changes.counts == {'modified': 1, 'added': 1, 'removed': 1}
+    assert by_event['modified']['programme_id'] == 'a2'
+    assert by_event['modified']['previous_programme_id'] == 'a'
+    assert by_event['modified']['changes'] == [{'path': 'amount', 'old': 500, 'new': 750}]
+    assert by_event['added']['programme_id'] == 'c'
+    assert by_event['removed']['programme_id'] == 'b'
+    assert by_event['removed']['title'] == 'RU'
+
+
+def test_change_feed_shared_identity_key(tmp_path, index):
+    # Deux paliers du même programme : même contributeur, même titre
+    Crawl(tmp_path, '1').apply(index, [programme('a', amount=1), programme('b', amount=2)], [link('a'), link('b')], [page(['electricity'])])
+    changes = feed(tmp_path, index)
+    Crawl(tmp_path, '2').apply(index, [programme('a', amount=1), programme('c', amount=3)], [link('a'), link('c')], [page(['electricity'])], changes)
+    assert [(event['event'], event['previous_programme_id'], event['programme_id']) for event in events(changes)] == [('modified', 'b', 'c')]
+
+
+def test_unchanged_crawl_writes_no_feed(tmp_path, index):
+    Crawl(tmp_path, '1').apply(index, [programme('a')], [link('a')], [page(['electricity'])])
+    changes = feed(tmp_path, index)
+    Crawl(tmp_path, '2').apply(index, [programme('a')], [link('a')], [page(['electricity'])], changes)
+    assert changes.counts == {}
+    assert not (tmp_path / 'changes.jsonl').exists()
+
+
+def test_diff_values():
+    old = {'amount': {'min': 1, 'max': 2}, 'conditions': ['a'], 'gone': True}
+    new = {'amount': {'min': 1, 'max': 3}, 'conditions': ['a', 'b'], 'new': 0}
+    assert list(diff_values(old, new)) == [
+        {'path': 'amount.max', 'old': 2, 'new': 3},
+        {'path': 'conditions', 'old': ['a'], 'new': ['a', 'b']},
+        {'path': 'gone', 'old': True},
+        {'path': 'new', 'new': 0},
+    ]
+
+
+def test_read_rows_jsonl(tmp_path):
+    path = tmp_path / 'rows.jsonl'
+    path.write_text('{"a": 1}\n\n{"a": 2}\n', encoding='utf-8')
+    assert list(read_rows(str(path))) == [{'a': 1}, {'a': 2}]
+
+
+
+class LockedOnCommit:
+    # Connexion dont la validation échoue, comme "database is locked" entre tranches
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc_info):
+        self.conn.rollback()
+        if exc_info[0] is None:
+            raise sqlite3.OperationalError('database is locked')
+
+
+def test_failed_commit_writes_no_feed(tmp_path, index):
+    Crawl(tmp_path, '1').apply(index, [programme('a')], [link('a')], [page(['electricity'])])
+    changes = feed(tmp_path, index)
+    index.conn = LockedOnCommit(index.conn)
+    with pytest.raises(sqlite3.OperationalError):
+        Crawl(tmp_path, '2').apply(index, [programme('b', 'RU')], [link('b')], [page(['electricity'])], changes)
+    index.conn = index.conn.conn
+    assert changes.counts == {'added': 1, 'removed': 1}
+    assert not (tmp_path / 'changes.jsonl').exists()
+    assert lookup(index, postal_code='1003') == [('electricity', 'a')]
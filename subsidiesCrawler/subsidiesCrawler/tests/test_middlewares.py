@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+import pytest
+from scrapy import Request, Spider
+from scrapy.http import Response
+from scrapy.utils.test import get_crawler
+
+from subsidiesCrawler.middlewares import AdaptiveThrottleMiddleware
+
+
+SETTINGS = {
+    'ADAPTIVE_THROTTLE_ENABLED': True,
+    'ADAPTIVE_THROTTLE_WINDOW': 10,
+    'ADAPTIVE_THROTTLE_TARGET_LATENCY': 1.0,
+    'ADAPTIVE_THROTTLE_MAX_ERROR_RATE': 0.05,
+    'ADAPTIVE_THROTTLE_START_DELAY': 0.5,
+    'ADAPTIVE_THROTTLE_MIN_DELAY': 0.1,
+    'ADAPTIVE_THROTTLE_MAX_DELAY': 60.0,
+    'ADAPTIVE_THROTTLE_BACKOFF_BASE': 1.0,
+    'ADAPTIVE_THROTTLE_START_CONCURRENCY': 2,
+    'ADAPTIVE_THROTTLE_MAX_CONCURRENCY': 4,
+}
+
+
+@pytest.fixture
+def slot():
+    # Slot du downloader réduit aux attributs modifiés par le middleware
+    return SimpleNamespace(delay=0.0, concurrency=16)
+
+
+@pytest.fixture
+def middleware(slot):
+    crawler = get_crawler(settings_dict=SETTINGS)
+    crawler.engine = SimpleNamespace(downloader=SimpleNamespace(slots={'example.com': slot}))
+    return AdaptiveThrottleMiddleware.from_crawler(crawler)
+
+
+def respond(middleware, status=200, latency=0.1, headers=None):
+    request = Request('https://example.com/', meta={'download_slot': 'example.com', 'download_latency': latency})
+    return middleware.process_response(request, Response(request.url, status=status, headers=headers), None)
+
+
+def retry_after(value):
+    return AdaptiveThrottleMiddleware._retry_after(Response('https://example.com/', headers={'Retry-After': value}))
+
+
+def test_retry_after_seconds():
+    assert retry_after('120') == 120.0
+
+
+@pytest.mark.parametrize('value', ['Wed, 21 Oct 2099 07:28:00 GMT', 'Wed, 21 Oct 2099 07:28:00 -0000'])
+def test_retry_after_dates(value):
+    assert retry_after(value) > 365 * 24 * 3600
+
+
+def test_retry_after_past_date():
+    assert retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+@pytest.mark.parametrize('value', ['', 'soon', '-5'])
+def test_retry_after_garbage(value):
+    assert retry_after(value) is None
+
+
+def test_spider_opened_sets_starting_rate(middleware):
+    spider = Spider('test')
+    middleware.spider_opened(spider)
+    assert spider.download_delay == 0.5
+    assert spider.max_concurrent_requests == 2
+
+
+def test_success_increases_concurrency_up_to_max(middleware, slot):
+    respond(middleware)
+    assert (slot.concurrency, slot.delay) == (3, pytest.approx(0.45))
+    for _ in range(5):
+        respond(middleware)
+    assert slot.concurrency == 4
+    for _ in range(50):
+        respond(middleware)
+    assert slot.delay == pytest.approx(0.1)
+
+
+def test_slow_responses_decrease_concurrency(middleware, slot):
+    respond(middleware)
+    respond(middleware, latency=5.0)
+    assert slot.concurrency == 2
+
+
+def test_failures_back_off_exponentially(middleware, slot):
+    respond(middleware)
+    respond(middleware, status=503)
+    assert slot.concurrency == 1
+    assert 0.5 <= slot.delay <= 1.5
+    respond(middleware, status=503)
+    respond(middleware, status=503)
+    assert 2.0 <= slot.delay <= 6.0
+    assert middleware.domains['example.com'].failures == 3
+    respond(middleware)
+    assert middleware.domains['example.com'].failures == 0
+
+
+def test_retry_after_raises_delay_within_max(middleware, slot):
+    respond(middleware, status=429, headers={'Retry-After': '30'})
+    assert slot.delay == 30.0
+    respond(middleware, status=429, headers={'Retry-After': 'Wed, 21 Oct 2099 07:28:00 -0000'})
+    assert slot.delay == 60.0